@@ -0,0 +1,204 @@
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import Request
+from starlette.requests import HTTPConnection
+from fastapi.responses import JSONResponse
+from jose import JWTError, jwt
+
+from app import cache, metrics
+from app.routes import ALGORITHM, SECRET_KEY
+
+# Seaux à jetons par type de route : (capacité, jetons rechargés par seconde)
+BUCKETS = {
+    "list": (100, 20),
+    "stats": (60, 10),
+    "default": (120, 40),
+}
+
+# Coût d'une requête de stats (les listes coûtent 1 + limit / 100)
+STATS_COST = 2
+
+# Routes de liste : (limit par défaut, limit maximum) ; le coût suit la taille de page demandée,
+# plafonné à la capacité du seau (une page de 10 000 modifications vide le seau à elle seule)
+LIST_ROUTES = {
+    "/emissions": (100, 1000),
+    "/air-quality": (100, 1000),
+    "/sources": (100, 1000),
+    "/changes": (1000, 10000),
+}
+
+# Délestage : attente cible dans la file du threadpool (moyenne glissante, en secondes)
+QUEUE_WAIT_TARGET = 0.2
+QUEUE_WAIT_ALPHA = 0.2
+# Au-delà de ce délai sans nouvelle mesure, la surcharge est considérée comme terminée
+QUEUE_WAIT_WINDOW = 1.0
+
+# Routes jamais limitées (sondes, documentation, dashboard)
+EXEMPT_PREFIXES = ("/health", "/metrics", "/docs", "/redoc", "/openapi.json", "/dashboard", "/static")
+
+# Seaux partagés par tous les workers (fichier du cache) : un seau inactif depuis plus longtemps
+# est forcément plein, il est supprimé
+BUCKET_IDLE = 60
+
+# Nettoyage des seaux inactifs toutes les N requêtes (par worker)
+BUCKET_PURGE_EVERY = 1000
+
+# Attente maximale du verrou du fichier partagé (s) : au-delà, la requête passe sans être limitée
+BUCKET_TIMEOUT = 0.05
+
+# Threads dédiés aux seaux : jamais sur la boucle asyncio (SSE, WebSocket), ni dans le threadpool
+# des routes, dont la file est justement ce que le délestage surveille
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ecotrack-admission")
+_local = threading.local()
+_takes = 0
+
+_queue = {"wait_avg": 0.0, "updated": 0.0}
+_queue_lock = threading.Lock()
+
+
+def client_key(request: Request):
+
+    #Identifiant du client : sujet du JWT s'il est valide, sinon adresse IP
+    auth = request.headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(auth[7:], SECRET_KEY, algorithms=[ALGORITHM])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}"
+        except JWTError:
+            pass
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def route_type(path: str):
+
+    #Type de route servant à choisir le seau et le coût
+    if path.startswith("/stats"):
+        return "stats"
+    if path in LIST_ROUTES:
+        return "list"
+    return "default"
+
+
+def request_cost(request: Request, kind: str):
+
+    #Coût en jetons, pondéré par la taille de page demandée
+    if kind == "list":
+        default, maximum = LIST_ROUTES[request.url.path]
+        try:
+            limit = int(request.query_params.get("limit", default))
+        except ValueError:
+            limit = default
+        return min(1 + min(max(limit, 0), maximum) / 100, BUCKETS["list"][0])
+    if kind == "stats":
+        return STATS_COST
+    return 1
+
+
+def _shared():
+
+    #Connexion au fichier partagé propre aux seaux (une par thread), avec une attente de verrou courte
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = cache.open_shared(BUCKET_TIMEOUT)
+    return conn
+
+
+def take_tokens(key: str, kind: str, cost: float):
+
+    #Consommer les jetons du seau (client, type de route) : 0 si accepté, sinon le délai (s) avant d'en avoir assez
+    # Une seule instruction atomique sur le fichier partagé : les N workers voient le même seau
+    # (horloge murale, l'horloge monotone n'étant pas commune aux processus)
+    global _takes
+    capacity, rate = BUCKETS[kind]
+    now = time.time()
+    refilled = "MIN(:capacity, tokens + MAX(:now - updated, 0) * :rate)"
+    try:
+        conn = _shared()
+        tokens, allowed = conn.execute(
+            "INSERT INTO buckets (key, kind, tokens, updated, allowed) VALUES (:key, :kind, :capacity - :cost, :now, 1) "
+            "ON CONFLICT (key, kind) DO UPDATE SET "
+            f"tokens = {refilled} - CASE WHEN {refilled} >= :cost THEN :cost ELSE 0 END, "
+            f"allowed = {refilled} >= :cost, "
+            "updated = MAX(updated, :now) "
+            "RETURNING tokens, allowed",
+            {"key": key, "kind": kind, "capacity": capacity, "rate": rate, "cost": cost, "now": now}
+        ).fetchone()
+    except sqlite3.Error:
+        # Fichier partagé verrouillé ou indisponible : laisser passer plutôt que bloquer ou refuser tout le monde
+        metrics.increment("rate_limit_errors_total", kind)
+        return 0
+
+    _takes += 1
+    if _takes % BUCKET_PURGE_EVERY == 0:
+        try:
+            conn.execute("DELETE FROM buckets WHERE updated < ?", (now - BUCKET_IDLE,))
+        except sqlite3.Error:
+            pass
+    if allowed:
+        return 0
+    count_shared("requests_throttled_total", kind)
+    return (cost - tokens) / rate
+
+
+def count_shared(name: str, kind: str):
+
+    #Compter un refus pour tous les workers (compteur du worker si le fichier est verrouillé)
+    try:
+        metrics.increment_shared(_shared(), name, kind)
+    except sqlite3.Error:
+        metrics.increment(name, kind)
+
+
+def is_overloaded():
+
+    #La file d'attente du threadpool dépasse-t-elle la cible de latence ?
+    with _queue_lock:
+        recent = time.monotonic() - _queue["updated"] < QUEUE_WAIT_WINDOW
+        return recent and _queue["wait_avg"] > QUEUE_WAIT_TARGET
+
+
+def record_queue_wait(connection: HTTPConnection):
+
+    #Dépendance synchrone : exécutée dans le threadpool, elle mesure l'attente en file (HTTP uniquement)
+    received = getattr(connection.state, "received_at", None)
+    if received is None:
+        return
+    wait = time.monotonic() - received
+    with _queue_lock:
+        _queue["wait_avg"] += QUEUE_WAIT_ALPHA * (wait - _queue["wait_avg"])
+        _queue["updated"] = time.monotonic()
+
+
+async def admission_middleware(request: Request, call_next):
+
+    #Limitation par client et délestage avant l'entrée dans la file du threadpool
+    path = request.url.path
+    if path.startswith(EXEMPT_PREFIXES) or request.method == "OPTIONS":
+        return await call_next(request)
+
+    kind = route_type(path)
+    loop = asyncio.get_running_loop()
+
+    if is_overloaded():
+        await loop.run_in_executor(_executor, count_shared, "requests_shed_total", kind)
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Serveur surchargé, réessayer plus tard"},
+            headers={"Retry-After": "1"}
+        )
+
+    delay = await loop.run_in_executor(_executor, take_tokens, client_key(request), kind, request_cost(request, kind))
+    if delay:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Trop de requêtes"},
+            headers={"Retry-After": str(math.ceil(delay))}
+        )
+
+    request.state.received_at = time.monotonic()
+    return await call_next(request)
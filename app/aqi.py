@@ -0,0 +1,65 @@
+import numpy as np
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from app.models import Global
+
+# Points de rupture de l'indice AQI (EPA) : concentrations -> indice, interpolés linéairement
+BREAKPOINTS = {
+    "pm25": ([0, 12.0, 35.4, 55.4, 150.4, 250.4, 350.4, 500.4], [0, 50, 100, 150, 200, 300, 400, 500]),  # µg/m³
+    "pm10": ([0, 54, 154, 254, 354, 424, 504, 604], [0, 50, 100, 150, 200, 300, 400, 500]),  # µg/m³
+    "no2": ([0, 53, 100, 360, 649, 1249, 1649, 2049], [0, 50, 100, 150, 200, 300, 400, 500]),  # ppb
+    "so2": ([0, 35, 75, 185, 304, 604, 804, 1004], [0, 50, 100, 150, 200, 300, 400, 500]),  # ppb
+    "co": ([0, 4.4, 9.4, 12.4, 15.4, 30.4, 40.4, 50.4], [0, 50, 100, 150, 200, 300, 400, 500]),  # ppm
+    "o3": ([0, 54, 70, 85, 105, 200, 504, 604], [0, 50, 100, 150, 200, 300, 400, 500]),  # ppb
+}
+
+# Conversion des unités du dataset (µg/m³, mg/m³ pour CO) vers celles des points de rupture (25 °C)
+UNIT_FACTORS = {
+    "pm25": 1.0,
+    "pm10": 1.0,
+    "no2": 24.45 / 46.01,
+    "so2": 24.45 / 64.07,
+    "co": 24.45 / 28.01,
+    "o3": 24.45 / 48.00,
+}
+
+POLLUTANTS = list(BREAKPOINTS)
+
+# Taille des lots du recalcul historique
+BACKFILL_BATCH_SIZE = 50000
+
+
+def compute_aqi(**columns):
+
+    #AQI vectorisé : maximum des sous-indices des six polluants (tableaux NumPy de même longueur)
+    sub_indices = []
+    for pollutant in POLLUTANTS:
+        values = np.asarray(columns[pollutant], dtype=np.float64) * UNIT_FACTORS[pollutant]
+        concentrations, indices = BREAKPOINTS[pollutant]
+        sub_indices.append(np.interp(np.nan_to_num(values, nan=0.0), concentrations, indices))
+    return np.round(np.max(sub_indices, axis=0), 1)
+
+
+def backfill_aqi(db: Session):
+
+    #Calculer l'AQI des lignes historiques qui n'en ont pas, par lots vectorisés
+    updated = 0
+    while True:
+        rows = (
+            db.query(Global.id, *[getattr(Global, p) for p in POLLUTANTS])
+            .filter(Global.aqi.is_(None))
+            .limit(BACKFILL_BATCH_SIZE)
+            .all()
+        )
+        if not rows:
+            break
+        data = np.array(rows, dtype=np.float64)
+        values = compute_aqi(**{p: data[:, i + 1] for i, p in enumerate(POLLUTANTS)})
+        db.execute(
+            update(Global.__table__).where(Global.__table__.c.id == bindparam("row_id")),
+            [{"row_id": int(row_id), "aqi": float(v)} for row_id, v in zip(data[:, 0], values)]
+        )
+        db.commit()
+        updated += len(rows)
+    return updated
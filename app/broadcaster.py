@@ -0,0 +1,177 @@
+import asyncio
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import func
+
+from app import database, metrics, schemas
+from app.database import SessionLocal
+from app.models import Emission, Global
+
+# Intervalle de scrutation des nouvelles lignes (écritures d'un autre worker ou du chargeur)
+POLL_INTERVAL = 2.0
+
+# Taille de la file de chaque abonné : au-delà, les événements les plus anciens sont perdus
+QUEUE_SIZE = 1000
+
+# Nombre maximum de lignes lues par table à chaque passage
+FETCH_LIMIT = 5000
+
+# Attente maximale entre deux passages après des échecs répétés (l'attente double à chaque échec)
+MAX_BACKOFF = 60.0
+
+
+class Subscriber:
+
+    def __init__(self, city: str = None, country: str = None):
+        self.city = city.lower() if city else None
+        self.country = country
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+
+    def matches(self, kind: str, row):
+
+        #Mêmes filtres que la liste /air-quality (ville partielle, pays exact)
+        if self.country and row.country != self.country:
+            return False
+        if self.city:
+            return kind == "air_quality" and row.city is not None and self.city in row.city.lower()
+        return True
+
+    def offer(self, event: dict):
+
+        #Ajouter un événement sans jamais bloquer le diffuseur (client lent : on perd les plus anciens)
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class Broadcaster:
+
+    def __init__(self):
+        self.subscribers = set()
+        self.last_ids = {}
+        self.generation = None
+        self._loop = None
+        self._wake = None
+        self._task = None
+
+    def start(self):
+
+        #Démarrer la boucle de diffusion sur la boucle asyncio courante
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+
+        #Arrêter la boucle de diffusion
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, city: str = None, country: str = None):
+
+        #Nouvel abonné avec ses filtres
+        if self._task is None:
+            self.start()
+        subscriber = Subscriber(city, country)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def notify(self):
+
+        #Signaler un commit d'ingestion (appelable depuis n'importe quel thread)
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self):
+
+        #Une seule requête par passage, quel que soit le nombre d'abonnés
+        failures = 0
+        initialized = False
+        while True:
+            if initialized:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+            try:
+                if not initialized or not self.subscribers:
+                    # Premier passage, ou personne n'écoute : avancer les curseurs sans rien diffuser
+                    await run_in_threadpool(self._init_last_ids)
+                    initialized = True
+                    events = []
+                else:
+                    events = await run_in_threadpool(self._fetch_new)
+                failures = 0
+            except Exception:
+                # Base indisponible (verrou, bascule d'instantané...) : compter, puis réessayer de moins en moins souvent
+                failures += 1
+                metrics.increment("broadcast_failures_total")
+                await asyncio.sleep(min(POLL_INTERVAL * 2 ** failures, MAX_BACKOFF))
+                continue
+            for kind, row, event in events:
+                for subscriber in list(self.subscribers):
+                    if subscriber.matches(kind, row):
+                        subscriber.offer(event)
+
+    def _init_last_ids(self):
+
+        #Positionner les curseurs sur les dernières lignes existantes
+        self.generation = database.generation()
+        db = SessionLocal()
+        try:
+            self.last_ids = {
+                "air_quality": db.query(func.max(Global.id)).scalar() or 0,
+                "emission": db.query(func.max(Emission.id)).scalar() or 0,
+            }
+        finally:
+            db.close()
+
+    def _fetch_new(self):
+
+        #Lire les lignes insérées depuis le dernier passage
+        database.refresh_snapshot()
+        if self.generation != database.generation():
+            # Nouvel instantané rechargé : rien à diffuser, on repart de ses dernières lignes
+            self._init_last_ids()
+            return []
+        events = []
+        db = SessionLocal()
+        try:
+            for kind, model, schema in (
+                ("air_quality", Global, schemas.GlobalResponse),
+                ("emission", Emission, schemas.EmissionResponse),
+            ):
+                rows = (
+                    db.query(model)
+                    .filter(model.id > self.last_ids.get(kind, 0))
+                    .order_by(model.id)
+                    .limit(FETCH_LIMIT)
+                    .all()
+                )
+                for row in rows:
+                    try:
+                        data = schema.model_validate(row).model_dump(mode="json")
+                    except ValidationError:
+                        continue
+                    events.append((kind, row, {"type": kind, "id": row.id, "data": data}))
+                if rows:
+                    self.last_ids[kind] = rows[-1].id
+                    if len(rows) == FETCH_LIMIT:
+                        self.notify()
+        finally:
+            db.close()
+        return events
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,136 @@
+import json
+import sqlite3
+import threading
+import time
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+# Cache partagé entre les workers uvicorn : un fichier SQLite local (WAL), sans service réseau
+CACHE_PATH = "./ecotrack_cache.db"
+
+# Nombre maximum de réponses conservées
+MAX_ENTRIES = 5000
+
+_local = threading.local()
+_adapters = {}
+_writes = 0
+
+
+def open_shared(timeout: float = 5):
+
+    #Nouvelle connexion au fichier partagé, tables créées au besoin
+    conn = sqlite3.connect(CACHE_PATH, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, version INTEGER NOT NULL, body BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('data_version', 1)")
+        # Seaux à jetons de la limitation de débit (app/admission.py), communs à tous les workers
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT NOT NULL, kind TEXT NOT NULL, tokens REAL NOT NULL, "
+            "updated REAL NOT NULL, allowed INTEGER NOT NULL, PRIMARY KEY (key, kind))"
+        )
+        # Compteurs additionnés par tous les workers (app/metrics.py)
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def _connect():
+
+    #Connexion SQLite au cache (une par thread)
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = open_shared()
+    return conn
+
+
+def get_data_version():
+
+    #Version courante des données (partagée par tous les workers)
+    row = _connect().execute("SELECT value FROM meta WHERE name = 'data_version'").fetchone()
+    return row[0] if row else 1
+
+
+def bump_data_version():
+
+    #Invalider le cache de tous les workers après un chargement de données
+    conn = _connect()
+    conn.execute("UPDATE meta SET value = value + 1 WHERE name = 'data_version'")
+    conn.execute("DELETE FROM cache WHERE version < (SELECT value FROM meta WHERE name = 'data_version')")
+    return get_data_version()
+
+
+def make_key(path: str, params: list = ()):
+
+    #Clé de cache : chemin + paramètres triés
+    return path + "?" + "&".join(f"{k}={v}" for k, v in sorted(params))
+
+
+def cache_key(request: Request):
+
+    #Clé de cache d'une requête HTTP
+    return make_key(request.url.path, request.query_params.multi_items())
+
+
+def get(key: str, version: int):
+
+    #Réponse sérialisée enregistrée pour cette version des données
+    row = _connect().execute("SELECT body FROM cache WHERE key = ? AND version = ?", (key, version)).fetchone()
+    return row[0] if row else None
+
+
+def put(key: str, body: bytes, version: int):
+
+    #Enregistrer une réponse calculée sur la version lue avant le calcul
+    # (ignorée si une écriture a changé les données entre-temps : elle serait périmée dès son insertion)
+    global _writes
+    conn = _connect()
+    conn.execute(
+        "INSERT OR REPLACE INTO cache (key, version, body, created) "
+        "SELECT ?, value, ?, ? FROM meta WHERE name = 'data_version' AND value = ?",
+        (key, body, time.time(), version)
+    )
+    _writes += 1
+    if _writes % 100 == 0:
+        conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (MAX_ENTRIES,)
+        )
+
+
+def lookup(request: Request):
+
+    #Réponse en cache pour cette requête, ou None (la version lue est gardée pour store)
+    request.state.cache_version = get_data_version()
+    body = get(cache_key(request), request.state.cache_version)
+    if body is None:
+        return None
+    return Response(content=body, media_type="application/json", headers={"X-Cache": "HIT"})
+
+
+def serialize(result, response_model=None):
+
+    #Sérialiser un résultat en JSON (via le schéma de réponse si fourni)
+    if response_model is None:
+        return json.dumps(jsonable_encoder(result)).encode("utf-8")
+    if response_model not in _adapters:
+        _adapters[response_model] = TypeAdapter(response_model)
+    adapter = _adapters[response_model]
+    return adapter.dump_json(adapter.validate_python(result, from_attributes=True))
+
+
+def store(request: Request, result, response_model=None):
+
+    #Sérialiser le résultat, le mettre en cache (version lue par lookup) et le renvoyer
+    body = serialize(result, response_model)
+    put(cache_key(request), body, request.state.cache_version)
+    return Response(content=body, media_type="application/json", headers={"X-Cache": "MISS"})
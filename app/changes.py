@@ -0,0 +1,116 @@
+from sqlalchemy import func
+
+from app.models import Change, Emission, Global, Source
+
+# Tables suivies par le journal des modifications : nom d'entité exposé par /changes
+TRACKED = {
+    "emission": Emission,
+    "air_quality": Global,
+    "source": Source,
+}
+
+# Drapeau des écritures en masse : tant qu'il contient une ligne, les triggers d'insertion ne journalisent rien
+# (la ligne n'existe que dans la transaction de l'écrivain, qui journalise ses ids d'un seul INSERT … SELECT)
+BULK_FLAG = "changes_bulk_mode"
+
+
+def _trigger_sql(entity: str, table: str, event: str):
+
+    #Trigger SQLite qui journalise une écriture (toutes origines : ORM, executemany, chargeur)
+    row = "OLD" if event == "DELETE" else "NEW"
+    # Insertions : suspendues pendant une écriture en masse (journalisées par plage d'ids, voir end_bulk)
+    when = f"WHEN NOT EXISTS (SELECT 1 FROM {BULK_FLAG}) " if event == "INSERT" else ""
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS changes_{entity}_{event.lower()} AFTER {event} ON {table} {when}"
+        f"BEGIN INSERT INTO {Change.__tablename__} (entity, row_id, op) "
+        f"VALUES ('{entity}', {row}.id, '{event.lower()}'); END"
+    )
+
+
+def ensure_triggers(bind):
+
+    #Créer les triggers du journal ; à leur création, les lignes existantes y sont inscrites comme insertions
+    with bind.connect() as conn:
+        # Vérification et inscription dans une même transaction d'écriture : un seul processus inscrit les lignes
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {BULK_FLAG} (active INTEGER NOT NULL)")
+        existing = dict(conn.exec_driver_sql("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").all())
+        for entity, model in TRACKED.items():
+            table = model.__tablename__
+            name = f"changes_{entity}_insert"
+            if name not in existing:
+                conn.exec_driver_sql(
+                    f"INSERT INTO {Change.__tablename__} (entity, row_id, op) "
+                    f"SELECT '{entity}', id, 'insert' FROM {table} ORDER BY id"
+                )
+            elif BULK_FLAG not in existing[name]:
+                # Trigger d'une version précédente, sans la condition du mode masse : le remplacer
+                conn.exec_driver_sql(f"DROP TRIGGER {name}")
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                conn.exec_driver_sql(_trigger_sql(entity, table, event))
+        conn.commit()
+
+
+def begin_bulk(conn, table):
+
+    #Suspendre la journalisation ligne à ligne des insertions dans la transaction en cours ; renvoie le dernier id
+    # (le drapeau est écrit en premier : la transaction tient le verrou d'écriture, l'id lu reste exact)
+    conn.exec_driver_sql(f"INSERT INTO {BULK_FLAG} (active) VALUES (1)")
+    return conn.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM {table.name}").scalar()
+
+
+def end_bulk(conn, table, after_id: int):
+
+    #Journaliser d'un seul INSERT … SELECT les lignes insérées après after_id, puis lever le drapeau
+    # (les lignes mises à jour par un upsert sont journalisées par le trigger UPDATE, toujours actif)
+    entity = next(name for name, model in TRACKED.items() if model.__tablename__ == table.name)
+    conn.exec_driver_sql(
+        f"INSERT INTO {Change.__tablename__} (entity, row_id, op) "
+        f"SELECT '{entity}', id, 'insert' FROM {table.name} WHERE id > ? ORDER BY id",
+        (after_id,)
+    )
+    conn.exec_driver_sql(f"DELETE FROM {BULK_FLAG}")
+
+
+def last_seq(conn, schema: str = "main"):
+
+    #Dernier numéro de séquence attribué (0 si le journal est vide ou absent)
+    if conn.exec_driver_sql(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'sqlite_sequence'"
+    ).first() is None:
+        return 0
+    row = conn.exec_driver_sql(
+        f"SELECT seq FROM {schema}.sqlite_sequence WHERE name = '{Change.__tablename__}'"
+    ).first()
+    return row[0] if row else 0
+
+
+def record_reset(conn, after_seq: int):
+
+    #Marquer un rechargement complet : les abonnés repartent de zéro à partir de cette séquence
+    conn.exec_driver_sql(
+        f"INSERT INTO {Change.__tablename__} (seq, entity, row_id, op) VALUES (?, 'all', 0, 'reset')",
+        (after_seq + 1,)
+    )
+
+
+def shift_sequence(conn, floor: int):
+
+    #Décaler le journal pour que toutes ses séquences dépassent floor (en deux passes, sans collision)
+    first = conn.exec_driver_sql(f"SELECT MIN(seq) FROM {Change.__tablename__}").scalar()
+    if first is None or first > floor:
+        return 0
+    offset = floor - first + 1
+    conn.exec_driver_sql(f"UPDATE {Change.__tablename__} SET seq = -seq")
+    conn.exec_driver_sql(f"UPDATE {Change.__tablename__} SET seq = -seq + ?", (offset,))
+    conn.exec_driver_sql(
+        f"UPDATE sqlite_sequence SET seq = (SELECT MAX(seq) FROM {Change.__tablename__}) "
+        f"WHERE name = '{Change.__tablename__}'"
+    )
+    return offset
+
+
+def current_seq(db):
+
+    #Séquence courante (point de départ d'une synchronisation complète)
+    return db.query(func.coalesce(func.max(Change.seq), 0)).scalar()
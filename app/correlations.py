@@ -0,0 +1,42 @@
+import numpy as np
+
+# Colonnes comparées : les six polluants puis la météo
+COLUMNS = ["pm25", "pm10", "no2", "so2", "co", "o3", "temperature", "humidity", "wind_speed"]
+
+
+def rank_columns(data: np.ndarray):
+
+    #Rangs de chaque colonne, ex æquo au rang moyen (comme scipy.stats.rankdata)
+    ranks = np.empty_like(data)
+    order = np.argsort(data, axis=0, kind="mergesort")
+    for j in range(data.shape[1]):
+        sorter = order[:, j]
+        inverse = np.empty(len(sorter), dtype=np.int64)
+        inverse[sorter] = np.arange(len(sorter))
+        values = data[sorter, j]
+        first = np.concatenate(([True], values[1:] != values[:-1]))
+        dense = np.cumsum(first)[inverse]
+        bounds = np.concatenate((np.nonzero(first)[0], [len(values)]))
+        ranks[:, j] = 0.5 * (bounds[dense] + bounds[dense - 1] + 1)
+    return ranks
+
+
+def _matrix(values: np.ndarray):
+    return [[None if np.isnan(v) else round(float(v), 4) for v in row] for row in values]
+
+
+def correlation_matrices(rows: list):
+
+    #Matrices de Pearson et de Spearman des neuf colonnes, en une passe sur le tableau des valeurs
+    data = np.array(rows, dtype=np.float64).reshape(-1, len(COLUMNS))
+    data = data[~np.isnan(data).any(axis=1)]
+    if len(data) < 2:
+        empty = [[None] * len(COLUMNS) for _ in COLUMNS]
+        return {"columns": COLUMNS, "count": len(data), "pearson": empty, "spearman": empty}
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pearson = np.corrcoef(data, rowvar=False)
+        # Spearman = Pearson sur les rangs
+        spearman = np.corrcoef(rank_columns(data), rowvar=False)
+
+    return {"columns": COLUMNS, "count": len(data), "pearson": _matrix(pearson), "spearman": _matrix(spearman)}
@@ -0,0 +1,125 @@
+from calendar import monthrange
+from datetime import date, timedelta
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from app.models import AirQualityCount, Emission, EmissionCount, Global
+from app.partitions import emission_source
+
+
+def month_key(d: date):
+
+    #Clé de mois des compteurs (YYYY-MM)
+    return d.strftime("%Y-%m")
+
+
+def month_bounds(month: str):
+
+    #Premier et dernier jour d'un mois YYYY-MM
+    year, m = int(month[:4]), int(month[5:7])
+    return date(year, m, 1), date(year, m, monthrange(year, m)[1])
+
+
+def rebuild_counts(db: Session):
+
+    #Recalculer tous les compteurs en une passe GROUP BY (après un chargement complet)
+    source = emission_source(db)
+    db.query(EmissionCount).delete()
+    db.execute(insert(EmissionCount).from_select(
+        ["country_id", "sector_id", "month", "count"],
+        select(source.country_id, source.sector_id, func.strftime('%Y-%m', source.date), func.count())
+        .group_by(source.country_id, source.sector_id, func.strftime('%Y-%m', source.date))
+    ))
+
+    db.query(AirQualityCount).delete()
+    db.execute(insert(AirQualityCount).from_select(
+        ["country_id", "city_id", "month", "count"],
+        select(Global.country_id, Global.city_id, func.strftime('%Y-%m', Global.date), func.count())
+        .group_by(Global.country_id, Global.city_id, func.strftime('%Y-%m', Global.date))
+    ))
+    db.commit()
+
+
+def counters_built(db: Session, counter):
+
+    #Les compteurs sont-ils initialisés ? (sinon les totaux sont comptés exactement)
+    return db.query(counter.count).first() is not None
+
+
+def ensure_counts(db: Session):
+
+    #Construire les compteurs d'une base déjà chargée qui n'en a pas encore
+    if (not counters_built(db, EmissionCount) and db.query(Emission.id).first() is not None) or \
+            (not counters_built(db, AirQualityCount) and db.query(Global.id).first() is not None):
+        rebuild_counts(db)
+
+
+def _add_inserted(db: Session, model, counter, dimension: str, after_id: int):
+
+    #Ajouter aux compteurs les lignes insérées après after_id : un seul upsert arithmétique, sans recompter
+    # (un upsert qui met à jour une ligne ne change ni son pays, ni son mois : seules les insertions comptent)
+    if not counters_built(db, counter):
+        # Compteurs pas encore construits : ensure_counts s'en chargera en une passe
+        return
+    db.connection().exec_driver_sql(
+        f"INSERT INTO {counter.__tablename__} (country_id, {dimension}, month, count) "
+        f"SELECT country_id, {dimension}, strftime('%Y-%m', date), COUNT(*) FROM {model.__tablename__} "
+        f"WHERE id > ? GROUP BY country_id, {dimension}, strftime('%Y-%m', date) "
+        f"ON CONFLICT (country_id, {dimension}, month) DO UPDATE SET count = count + excluded.count",
+        (after_id,)
+    )
+
+
+def add_emission_counts(db: Session, after_id: int):
+
+    #Compter les émissions insérées par une écriture en masse, dans la transaction en cours
+    _add_inserted(db, Emission, EmissionCount, "sector_id", after_id)
+
+
+def add_air_quality_counts(db: Session, after_id: int):
+
+    #Compter les mesures insérées par une écriture en masse, dans la transaction en cours
+    _add_inserted(db, Global, AirQualityCount, "city_id", after_id)
+
+
+def estimate_total(db: Session, counter, conditions: list, date_from: date, date_to: date, exact_count):
+
+    #Total depuis les compteurs : mois complets exacts, mois partiels proratisés (estimation)
+    if not counters_built(db, counter):
+        return exact_count(date_from, date_to), "exact"
+
+    first_full = date_from
+    if date_from and date_from.day != 1:
+        first_full = month_bounds(month_key(date_from))[1] + timedelta(days=1)
+    last_full = date_to
+    if date_to and date_to != month_bounds(month_key(date_to))[1]:
+        last_full = month_bounds(month_key(date_to))[0] - timedelta(days=1)
+
+    # Moins d'un mois complet couvert : le comptage exact reste borné à deux mois au plus
+    if first_full and last_full and first_full > last_full:
+        return exact_count(date_from, date_to), "exact"
+
+    def month_sum(*month_conditions):
+        return db.query(func.coalesce(func.sum(counter.count), 0)).filter(*conditions, *month_conditions).scalar()
+
+    full = []
+    if first_full:
+        full.append(counter.month >= month_key(first_full))
+    if last_full:
+        full.append(counter.month <= month_key(last_full))
+    total = month_sum(*full)
+    kind = "exact"
+
+    partial_months = []
+    if date_from and first_full != date_from:
+        partial_months.append((date_from, month_bounds(month_key(date_from))[1]))
+    if date_to and last_full != date_to:
+        partial_months.append((month_bounds(month_key(date_to))[0], date_to))
+
+    for covered_start, covered_end in partial_months:
+        days_in_month = month_bounds(month_key(covered_start))[1].day
+        share = ((covered_end - covered_start).days + 1) / days_in_month
+        total += round(month_sum(counter.month == month_key(covered_start)) * share)
+        kind = "estimated"
+
+    return int(total), kind
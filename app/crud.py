@@ -1,47 +1,90 @@
 from sqlalchemy import and_, asc, desc, func
 from sqlalchemy.orm import Session
+from pydantic import TypeAdapter, ValidationError
+from operator import itemgetter
+from typing import List
 import bcrypt
-from datetime import datetime
-from app.models import Emission, Global, Source, User
+from datetime import date, datetime, timedelta
+from app import dimensions, readonly
+from app.cache import bump_data_version
+from app.counters import add_air_quality_counts, add_emission_counts, estimate_total
+from app.changes import TRACKED, begin_bulk, end_bulk
+from app.models import AirQualityCount, Change, Emission, EmissionCount, Global, Source, User
+from app.partitions import archived_years, emission_source
 from app.schemas import (
-    EmissionCreate, EmissionUpdate,
-    GlobalCreate, GlobalUpdate,
-    SourceCreate, SourceUpdate,
+    EmissionCreate, EmissionUpdate, EmissionResponse,
+    GlobalCreate, GlobalUpdate, GlobalResponse,
+    SourceCreate, SourceUpdate, SourceResponse,
     UserCreate, UserUpdate
 )
 
+# Forme des lignes renvoyées par /changes (mêmes champs que les endpoints de lecture)
+CHANGE_SCHEMAS = {"emission": EmissionResponse, "air_quality": GlobalResponse, "source": SourceResponse}
+
 
 # CRUD EMISSIONS
 def get_emissions(db: Session, skip: int = 0, limit: int = 100, filters: dict = None):
 
-    #Liste des émissions avec filtres et pagination
-    query = db.query(Emission)
+    #Liste des émissions avec filtres et pagination (partitions élaguées par les dates)
+    filters = filters or {}
+    source = emission_source(db, filters.get("date_from"), filters.get("date_to"))
+    query = _filter_emissions(db.query(source), source, filters)
     
     if filters:
-        if filters.get("country"):
-            query = query.filter(Emission.country == filters["country"])
-        if filters.get("sector"):
-            query = query.filter(Emission.sector == filters["sector"])
-        if filters.get("date_from"):
-            query = query.filter(Emission.date >= filters["date_from"])
-        if filters.get("date_to"):
-            query = query.filter(Emission.date <= filters["date_to"])
-        
         order = filters.get("order_by")
         if order:
             desc_mode = order.startswith("-")
             field_name = order.lstrip('-')
             if hasattr(Emission, field_name):
-                field = getattr(Emission, field_name)
+                query, field = dimensions.sort_column(query, source, field_name)
                 query = query.order_by(desc(field) if desc_mode else asc(field))
     
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if readonly.is_readonly(db):
+        return readonly.fetch_rows(query, source, Emission)
+    return query.all()
+
+
+def _filter_emissions(query, source, filters: dict):
+
+    #Appliquer les filtres pays / secteur / dates de la liste des émissions
+    if filters.get("country"):
+        query = query.filter(dimensions.equals(source.country_id, "country", filters["country"]))
+    if filters.get("sector"):
+        query = query.filter(dimensions.equals(source.sector_id, "sector", filters["sector"]))
+    if filters.get("date_from"):
+        query = query.filter(source.date >= filters["date_from"])
+    if filters.get("date_to"):
+        query = query.filter(source.date <= filters["date_to"])
+    return query
+
+
+def count_emissions(db: Session, filters: dict = None):
+
+    #Total des émissions filtrées : compteurs par (pays, secteur, mois), COUNT(*) exact en dernier recours
+    filters = filters or {}
+
+    def exact_count(date_from, date_to):
+        source = emission_source(db, date_from, date_to)
+        return _filter_emissions(db.query(func.count()).select_from(source), source, filters).scalar()
+
+    conditions = []
+    if filters.get("country"):
+        conditions.append(dimensions.equals(EmissionCount.country_id, "country", filters["country"]))
+    if filters.get("sector"):
+        conditions.append(dimensions.equals(EmissionCount.sector_id, "sector", filters["sector"]))
+    return estimate_total(db, EmissionCount, conditions, filters.get("date_from"), filters.get("date_to"), exact_count)
 
 
 def get_emission_by_id(db: Session, emission_id: int):
 
-    #Récupérer une émission par ID
-    return db.query(Emission).filter(Emission.id == emission_id).first()
+    #Récupérer une émission par ID (table principale puis partitions archivées)
+    emission = db.query(Emission).filter(Emission.id == emission_id).first()
+    if emission is None:
+        source = emission_source(db)
+        if source is not Emission:
+            emission = db.query(source).filter(source.id == emission_id).first()
+    return emission
 
 
 # CRUD GLOBAL
@@ -51,24 +94,51 @@ def get_air_quality(db: Session, skip: int = 0, limit: int = 100, filters: dict
     query = db.query(Global)
     
     if filters:
-        if filters.get("city"):
-            query = query.filter(Global.city.ilike(f"%{filters['city']}%"))
-        if filters.get("country"):
-            query = query.filter(Global.country == filters["country"])
-        if filters.get("date_from"):
-            query = query.filter(Global.date >= filters["date_from"])
-        if filters.get("date_to"):
-            query = query.filter(Global.date <= filters["date_to"])
+        query = _filter_air_quality(query, filters)
         
         order = filters.get("order_by")
         if order:
             desc_mode = order.startswith("-")
             field_name = order.lstrip('-')
             if hasattr(Global, field_name):
-                field = getattr(Global, field_name)
+                query, field = dimensions.sort_column(query, Global, field_name)
                 query = query.order_by(desc(field) if desc_mode else asc(field))
     
-    return query.offset(skip).limit(limit).all()
+    query = query.offset(skip).limit(limit)
+    if readonly.is_readonly(db):
+        return readonly.fetch_rows(query, Global, Global)
+    return query.all()
+
+
+def _filter_air_quality(query, filters: dict):
+
+    #Appliquer les filtres ville / pays / dates de la liste des mesures
+    if filters.get("city"):
+        query = query.filter(dimensions.contains(Global.city_id, "city", filters["city"]))
+    if filters.get("country"):
+        query = query.filter(dimensions.equals(Global.country_id, "country", filters["country"]))
+    if filters.get("date_from"):
+        query = query.filter(Global.date >= filters["date_from"])
+    if filters.get("date_to"):
+        query = query.filter(Global.date <= filters["date_to"])
+    return query
+
+
+def count_air_quality(db: Session, filters: dict = None):
+
+    #Total des mesures filtrées : compteurs par (pays, ville, mois), COUNT(*) exact en dernier recours
+    filters = filters or {}
+
+    def exact_count(date_from, date_to):
+        bounded = {**filters, "date_from": date_from, "date_to": date_to}
+        return _filter_air_quality(db.query(func.count(Global.id)), bounded).scalar()
+
+    conditions = []
+    if filters.get("city"):
+        conditions.append(dimensions.contains(AirQualityCount.city_id, "city", filters["city"]))
+    if filters.get("country"):
+        conditions.append(dimensions.equals(AirQualityCount.country_id, "country", filters["country"]))
+    return estimate_total(db, AirQualityCount, conditions, filters.get("date_from"), filters.get("date_to"), exact_count)
 
 
 def get_air_quality_by_id(db: Session, air_quality_id: int):
@@ -81,7 +151,10 @@ def get_air_quality_by_id(db: Session, air_quality_id: int):
 def get_sources(db: Session, skip: int = 0, limit: int = 100):
 
     #Liste des sources avec pagination
-    return db.query(Source).offset(skip).limit(limit).all()
+    query = db.query(Source).offset(skip).limit(limit)
+    if readonly.is_readonly(db):
+        return readonly.fetch_rows(query, Source, Source)
+    return query.all()
 
 
 def get_source_by_id(db: Session, source_id: int):
@@ -215,7 +288,7 @@ def get_air_quality_averages(db: Session, date_from: str = None, date_to: str =
         to_date = datetime.strptime(date_to, '%Y-%m-%d').date()
         query = query.filter(Global.date <= to_date)
     if zone:
-        query = query.filter(Global.country == zone)
+        query = query.filter(dimensions.equals(Global.country_id, "country", zone))
     
     result = query.first()
     
@@ -232,20 +305,21 @@ def get_air_quality_averages(db: Session, date_from: str = None, date_to: str =
 def get_co2_trend(db: Session, zone: str = None, period: str = "monthly", sector: str = None):
 
     #Obtenir l'évolution des émissions CO2
+    source = emission_source(db)
     if period == "monthly":
-        date_format = func.strftime('%Y-%m', Emission.date)
+        date_format = func.strftime('%Y-%m', source.date)
     else:
-        date_format = func.strftime('%Y', Emission.date)
+        date_format = func.strftime('%Y', source.date)
     
     query = db.query(
         date_format.label('period'),
-        func.sum(Emission.value).label('total')
+        func.sum(source.value).label('total')
     )
     
     if zone:
-        query = query.filter(Emission.country == zone)
+        query = query.filter(dimensions.equals(source.country_id, "country", zone))
     if sector:
-        query = query.filter(Emission.sector == sector)
+        query = query.filter(dimensions.equals(source.sector_id, "sector", sector))
     
     query = query.group_by('period').order_by('period')
     
@@ -255,3 +329,323 @@ def get_co2_trend(db: Session, zone: str = None, period: str = "monthly", sector
         "labels": [r.period for r in results],
         "values": [round(r.total, 2) for r in results]
     }
+
+
+# SÉRIES TEMPORELLES (graphiques)
+# Les modules de calcul (downsampling, rolling, correlations) sont importés dans les fonctions :
+# NumPy n'est chargé qu'au premier appel, pas au démarrage des workers
+def _air_daily(db: Session, pollutant: str, city: str, zone: str, from_date, to_date):
+
+    #Moyenne journalière d'un polluant (toutes villes retenues confondues)
+    column = getattr(Global, pollutant)
+    query = db.query(Global.date, func.avg(column).label('value'))
+
+    if city:
+        query = query.filter(dimensions.contains(Global.city_id, "city", city))
+    if zone:
+        query = query.filter(dimensions.equals(Global.country_id, "country", zone))
+    if from_date:
+        query = query.filter(Global.date >= from_date)
+    if to_date:
+        query = query.filter(Global.date <= to_date)
+
+    return query.group_by(Global.date).order_by(Global.date).all()
+
+
+def _co2_daily(db: Session, zone: str, sector: str, from_date, to_date):
+
+    #Somme journalière des émissions CO2 (partitions élaguées par les dates)
+    source = emission_source(db, from_date, to_date)
+    query = db.query(source.date, func.sum(source.value).label('value'))
+
+    if zone:
+        query = query.filter(dimensions.equals(source.country_id, "country", zone))
+    if sector:
+        query = query.filter(dimensions.equals(source.sector_id, "sector", sector))
+    if from_date:
+        query = query.filter(source.date >= from_date)
+    if to_date:
+        query = query.filter(source.date <= to_date)
+
+    return query.group_by(source.date).order_by(source.date).all()
+
+
+def get_air_timeseries(db: Session, pollutant: str = "pm25", city: str = None, zone: str = None,
+                       date_from: date = None, date_to: date = None, points: int = 1000, method: str = "lttb"):
+
+    #Série journalière d'un polluant (moyenne des villes), réduite côté serveur
+    from app.downsampling import downsample
+
+    rows = _air_daily(db, pollutant, city, zone, date_from, date_to)
+    return downsample([r.date for r in rows], [r.value for r in rows], points, method)
+
+
+def get_co2_timeseries(db: Session, zone: str = None, sector: str = None,
+                       date_from: date = None, date_to: date = None, points: int = 1000, method: str = "lttb"):
+
+    #Série journalière des émissions CO2 (somme), réduite côté serveur
+    from app.downsampling import downsample
+
+    rows = _co2_daily(db, zone, sector, date_from, date_to)
+    return downsample([r.date for r in rows], [r.value for r in rows], points, method)
+
+
+# FENÊTRES GLISSANTES
+def _lookback(from_date, windows: list):
+
+    #Début de lecture : un an et la plus grande fenêtre avant la période demandée
+    if not from_date:
+        return None
+    return from_date - timedelta(days=366 + max(windows))
+
+
+def get_air_rolling(db: Session, pollutant: str = "pm25", city: str = None, zone: str = None,
+                    date_from: date = None, date_to: date = None, windows: list = (7, 30)):
+
+    #Moyennes/maxima glissants et variation annuelle d'un polluant
+    from app.rolling import rolling_stats
+
+    rows = _air_daily(db, pollutant, city, zone, _lookback(date_from, windows), date_to)
+    return rolling_stats([r.date for r in rows], [r.value for r in rows], windows, date_from)
+
+
+def get_co2_rolling(db: Session, zone: str = None, sector: str = None,
+                    date_from: date = None, date_to: date = None, windows: list = (7, 30)):
+
+    #Moyennes/maxima glissants et variation annuelle des émissions CO2
+    from app.rolling import rolling_stats
+
+    rows = _co2_daily(db, zone, sector, _lookback(date_from, windows), date_to)
+    return rolling_stats([r.date for r in rows], [r.value for r in rows], windows, date_from)
+
+
+def get_air_correlations(db: Session, filters: dict = None):
+
+    #Corrélations polluants / météo (Pearson et Spearman) sur les mesures filtrées
+    from app.correlations import COLUMNS, correlation_matrices
+
+    query = _filter_air_quality(db.query(*[getattr(Global, c) for c in COLUMNS]), filters or {})
+    return correlation_matrices(query.all())
+
+
+def get_air_leaderboard(db: Session, day: date = None, zone: str = None, n: int = 10, order: str = "worst"):
+
+    #Classement des N villes les plus (ou moins) polluées d'une date, lu dans l'ordre de l'index (date, aqi)
+    target = day or db.query(func.max(Global.date)).scalar()
+    if target is None:
+        return {"date": None, "order": order, "cities": []}
+
+    query = db.query(Global.city_id, Global.country_id, Global.aqi).filter(Global.date == target, Global.aqi.isnot(None))
+    if zone:
+        query = query.filter(dimensions.equals(Global.country_id, "country", zone))
+    query = query.order_by(desc(Global.aqi) if order == "worst" else asc(Global.aqi))
+
+    # Plusieurs mesures par ville et par jour : on garde la première rencontrée, puis on s'arrête à N villes
+    cities = []
+    seen = set()
+    for row in query.yield_per(max(n * 2, 100)):
+        key = (row.city_id, row.country_id)
+        if key in seen:
+            continue
+        seen.add(key)
+        cities.append({
+            "rank": len(cities) + 1,
+            "city": dimensions.name_of("city", row.city_id),
+            "country": dimensions.name_of("country", row.country_id),
+            "aqi": row.aqi
+        })
+        if len(cities) == n:
+            break
+
+    return {"date": target.isoformat(), "order": order, "cities": cities}
+
+
+# JOURNAL DES MODIFICATIONS
+def get_changes(db: Session, since: int = 0, limit: int = 1000):
+
+    #Modifications après la séquence since, compactées : une entrée par ligne avec son état courant
+    entries = db.query(Change).filter(Change.seq > since).order_by(Change.seq).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        return {"changes": [], "next": since, "has_more": False}
+
+    # Un rechargement complet rend caduques les modifications qui le précèdent
+    resets = [i for i, e in enumerate(entries) if e.op == "reset"]
+    if resets:
+        entries = entries[resets[-1]:]
+
+    latest = {}
+    for e in entries:
+        latest[(e.entity, e.row_id)] = e
+
+    current = {}
+    for entity, model in TRACKED.items():
+        ids = [row_id for (kind, row_id), e in latest.items() if kind == entity and e.op != "delete"]
+        if not ids:
+            continue
+        source = emission_source(db) if model is Emission else model
+        schema = CHANGE_SCHEMAS[entity]
+        # Lecture en tuples : seules les valeurs sont renvoyées
+        for row in readonly.fetch_rows(db.query(source).filter(source.id.in_(ids)), source, model):
+            current[(entity, row.id)] = {field: getattr(row, field) for field in schema.model_fields}
+
+    changes = []
+    for key, e in sorted(latest.items(), key=lambda item: item[1].seq):
+        data = current.get(key)
+        op = e.op if data is not None or e.op == "reset" else "delete"
+        changes.append({"seq": e.seq, "entity": e.entity, "id": e.row_id, "op": op, "data": data})
+
+    return {"changes": changes, "next": entries[-1].seq, "has_more": has_more}
+
+
+# ÉCRITURES EN MASSE
+BULK_BATCH_SIZE = 5000
+
+_list_adapters = {}
+
+
+def _list_adapter(schema):
+
+    #TypeAdapter List[schema] (construit une seule fois)
+    if schema not in _list_adapters:
+        _list_adapters[schema] = TypeAdapter(List[schema])
+    return _list_adapters[schema]
+
+
+def _validate_batch(adapter: TypeAdapter, schema, batch: list, offset: int, errors: list):
+
+    #Valider un lot d'un coup ; les lignes invalides sont écartées avec leurs erreurs
+    try:
+        return list(enumerate(adapter.validate_python(batch), start=offset))
+    except ValidationError as e:
+        row_errors = {}
+        for err in e.errors(include_url=False, include_context=False):
+            index, field = err["loc"][0], ".".join(str(part) for part in err["loc"][1:])
+            row_errors.setdefault(index, []).append({"field": field, "message": err["msg"]})
+
+    valid = []
+    for i, record in enumerate(batch):
+        if i in row_errors:
+            errors.append({"index": offset + i, "errors": row_errors[i]})
+        else:
+            valid.append((offset + i, schema.model_validate(record)))
+    return valid
+
+
+def _unique_key(db: Session, table):
+
+    #Colonnes de la clé naturelle (None si la table n'en déclare pas) ; son index doit exister en base
+    existing = {row[1] for row in db.connection().exec_driver_sql(f"PRAGMA index_list({table.name})")}
+    for index in table.indexes:
+        if index.unique:
+            if index.name not in existing:
+                # Sans l'index, ON CONFLICT ne s'appliquerait pas : l'upsert dupliquerait les lignes
+                raise RuntimeError(f"Index unique {index.name} absent : relancer l'API pour migrer le schéma")
+            return [c.name for c in index.columns]
+    return None
+
+
+def _bulk_upsert(db: Session, table, schema, records: list, reject=None, on_write=None, enrich=None):
+
+    #Valider par lots puis écrire toutes les lignes valides en une transaction (executemany, upsert sur la clé naturelle)
+    adapter = _list_adapter(schema)
+    fields = list(schema.model_fields)
+    columns = fields
+    # Valeurs d'un enregistrement dans l'ordre des colonnes (extraction en C, sans boucle Python par champ)
+    values = itemgetter(*fields)
+    errors = []
+    rows = []
+
+    for offset in range(0, len(records), BULK_BATCH_SIZE):
+        batch = records[offset:offset + BULK_BATCH_SIZE]
+        kept = []
+        for index, item in _validate_batch(adapter, schema, batch, offset, errors):
+            message = reject(item) if reject else None
+            if message:
+                errors.append({"index": index, "errors": [{"field": "", "message": message}]})
+            else:
+                kept.append(item)
+        # mode json : dates au format ISO, comme les stocke SQLAlchemy
+        batch_rows = [values(row) for row in adapter.dump_python(kept, mode="json")]
+        if batch_rows:
+            columns, batch_rows = _encode_dimensions(db, fields, batch_rows)
+            if enrich:
+                columns, batch_rows = enrich(columns, batch_rows)
+        rows.extend(batch_rows)
+
+    if rows:
+        sql = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        key = _unique_key(db, table)
+        if key:
+            updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c not in key)
+            sql += f" ON CONFLICT ({', '.join(key)}) DO UPDATE SET {updates}"
+        try:
+            conn = db.connection()
+            # Triggers d'insertion suspendus : les nouvelles lignes sont journalisées en une fois
+            last_id = begin_bulk(conn, table)
+            conn.exec_driver_sql(sql, rows)
+            end_bulk(conn, table, last_id)
+            if on_write:
+                on_write(db, last_id)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        bump_data_version()
+
+    errors.sort(key=lambda e: e["index"])
+    return {"received": len(records), "written": len(rows), "rejected": len(errors), "errors": errors}
+
+
+def bulk_upsert_emissions(db: Session, records: list):
+
+    #Insérer ou mettre à jour des émissions en masse (les années archivées sont en lecture seule)
+    archived = archived_years(db)
+
+    def reject(item):
+        if item.date.year in archived:
+            return f"L'année {item.date.year} est archivée (lecture seule)"
+        return None
+
+    return _bulk_upsert(db, Emission.__table__, EmissionCreate, records, reject, add_emission_counts)
+
+
+def bulk_insert_air_quality(db: Session, records: list):
+
+    #Insérer des mesures de qualité d'air en masse (plusieurs mesures par ville et par jour sont possibles)
+    return _bulk_upsert(db, Global.__table__, GlobalCreate, records,
+                        on_write=add_air_quality_counts, enrich=_with_aqi)
+
+
+def _encode_dimensions(db: Session, columns: list, rows: list):
+
+    #Remplacer pays / ville / secteur par leurs identifiants (les noms inconnus sont créés)
+    encoded = list(columns)
+    lookups = []
+    for position, name in enumerate(columns):
+        if name in dimensions.TABLES:
+            ids = dimensions.get_or_create_ids(db, name, {row[position] for row in rows})
+            lookups.append((position, ids.get))
+            encoded[position] = f"{name}_id"
+    if not lookups:
+        return encoded, rows
+
+    # Une seule passe sur les lignes pour toutes les dimensions
+    def encode(row):
+        row = list(row)
+        for position, lookup in lookups:
+            row[position] = lookup(row[position])
+        return tuple(row)
+    return encoded, [encode(row) for row in rows]
+
+
+def _with_aqi(columns: list, rows: list):
+
+    #Ajouter l'AQI calculé sur tout le lot (vectorisé) aux lignes à insérer
+    from app.aqi import POLLUTANTS, compute_aqi
+    positions = [columns.index(p) for p in POLLUTANTS]
+    values = compute_aqi(**{
+        p: [row[i] if row[i] is not None else float("nan") for row in rows] for p, i in zip(POLLUTANTS, positions)
+    })
+    return columns + ["aqi"], [row + (float(v),) for row, v in zip(rows, values)]
@@ -1,14 +1,59 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+# Base SQLite par défaut
+DATABASE_PATH = "./ecotrack.db"
+
+# Rechargement sans interruption : chaque rechargement produit un instantané complet,
+# publié en remplaçant atomiquement le fichier pointeur par le chemin du nouvel instantané
+SNAPSHOTS_DIR = "./snapshots"
+CURRENT_POINTER = "./ecotrack.current"
+
+# Attente maximale du verrou des migrations (un autre worker crée tables, index et triggers)
+SCHEMA_LOCK_TIMEOUT = 300
+
 # URL de la base (SQLite ici)
-SQLALCHEMY_DATABASE_URL = "sqlite:///./ecotrack.db"
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+
+
+def make_engine(path: str):
+
+    #Moteur SQLite sur un fichier de base
+    return create_engine(
+        f"sqlite:///{path}",
+        connect_args={
+            "check_same_thread": False,  # nécessaire pour SQLite + FastAPI
+            "uri": True  # permet d'attacher les partitions archivées en lecture seule (file:...?mode=ro)
+        }
+    )
+
+
+def current_path():
+
+    #Fichier de la base servie : dernier instantané publié, sinon la base par défaut
+    try:
+        with open(CURRENT_POINTER, encoding="utf-8") as f:
+            path = f.read().strip()
+        if path and os.path.exists(path):
+            return path
+    except FileNotFoundError:
+        pass
+    return DATABASE_PATH
+
+
+def _pointer_mtime():
+    try:
+        return os.stat(CURRENT_POINTER).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
 
 # Création du moteur
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False}  # nécessaire pour SQLite + FastAPI
-)
+engine = make_engine(current_path())
 
 # Session locale
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -16,9 +61,59 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Base pour les modèles
 Base = declarative_base()
 
+# Bascule vers un nouvel instantané : numéro incrémenté à chaque changement de moteur
+_snapshot = {"mtime": _pointer_mtime(), "generation": 0}
+_snapshot_lock = threading.Lock()
+
+
+def generation():
+
+    #Numéro de l'instantané servi par ce worker (change à chaque bascule)
+    return _snapshot["generation"]
+
+
+def refresh_snapshot():
+
+    #Basculer vers le dernier instantané publié (un simple stat tant que rien ne change)
+    global engine
+    mtime = _pointer_mtime()
+    if mtime == _snapshot["mtime"]:
+        return False
+    with _snapshot_lock:
+        if mtime == _snapshot["mtime"]:
+            return False
+        _snapshot["mtime"] = mtime
+        path = current_path()
+        if os.path.abspath(path) == os.path.abspath(engine.url.database):
+            return False
+        old = engine
+        engine = make_engine(path)
+        # Les nouvelles sessions utilisent le nouveau moteur ; celles en cours finissent sur l'ancien
+        SessionLocal.configure(bind=engine)
+        _snapshot["generation"] += 1
+    # Les connexions encore prêtées ne sont pas coupées : elles se ferment à leur restitution
+    old.dispose()
+    from app import dimensions
+    dimensions.load()
+    return True
+
+
+@contextmanager
+def schema_lock(bind):
+
+    #Verrou inter-processus des migrations : un seul worker (ou chargeur) à la fois prépare la base
+    # (fichier SQLite voisin tenu en transaction exclusive, relâché à la fermeture, même après un plantage)
+    conn = sqlite3.connect(bind.url.database + ".lock", timeout=SCHEMA_LOCK_TIMEOUT, isolation_level=None)
+    try:
+        conn.execute("BEGIN EXCLUSIVE")
+        yield
+    finally:
+        conn.close()
+
 
 # Dépendance : récupérer une session et la fermer proprement
 def get_db():
+    refresh_snapshot()
     db = SessionLocal()
     try:
         yield db
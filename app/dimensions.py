@@ -0,0 +1,233 @@
+import threading
+from sqlalchemy import create_engine, event, false, insert, select
+from sqlalchemy.orm import Session
+
+from app import cache, database
+from app.database import Base
+from app.models import AirQualityCount, City, Country, Emission, EmissionCount, EmissionPartition, Global, Sector
+from app.partitions import _compact, partition_path
+
+# Tables de dimensions, par nom de colonne encodée (l'API continue de recevoir et renvoyer les noms)
+TABLES = {"country": Country, "city": City, "sector": Sector}
+
+# Colonnes texte des anciennes bases, remplacées par <colonne>_id
+LEGACY_COLUMNS = {
+    Emission.__tablename__: ["country", "sector"],
+    Global.__tablename__: ["city", "country"],
+}
+
+# Dictionnaires en mémoire : nom -> id et id -> nom, chargés une fois par worker
+_ids = {dimension: {} for dimension in TABLES}
+_names = {dimension: {} for dimension in TABLES}
+_state = {"loaded": False, "version": None}
+_lock = threading.Lock()
+
+
+def _remember(dimension: str, pairs):
+    for id_, name in pairs:
+        _ids[dimension][name] = id_
+        _names[dimension][id_] = name
+
+
+def load():
+
+    #Charger (ou recharger) les dictionnaires depuis les tables de dimensions
+    with database.engine.connect() as conn:
+        rows = {dimension: conn.execute(select(model.id, model.name)).all() for dimension, model in TABLES.items()}
+    with _lock:
+        for dimension, pairs in rows.items():
+            _ids[dimension] = {name: id_ for id_, name in pairs}
+            _names[dimension] = {id_: name for id_, name in pairs}
+        _state["loaded"] = True
+        _state["version"] = cache.get_data_version()
+
+
+def _ensure_loaded():
+    if not _state["loaded"]:
+        load()
+
+
+def name_of(dimension: str, id_: int):
+
+    #Nom d'un identifiant (lecture en base seulement s'il est inconnu du dictionnaire)
+    if id_ is None:
+        return None
+    name = _names[dimension].get(id_)
+    if name is None:
+        _ensure_loaded()
+        name = _names[dimension].get(id_)
+    if name is None:
+        model = TABLES[dimension]
+        with database.engine.connect() as conn:
+            name = conn.execute(select(model.name).where(model.id == id_)).scalar()
+        if name is not None:
+            with _lock:
+                _remember(dimension, [(id_, name)])
+    return name
+
+
+def id_of(dimension: str, name: str):
+
+    #Identifiant d'un nom, ou None s'il n'existe pas
+    _ensure_loaded()
+    id_ = _ids[dimension].get(name)
+    if id_ is None:
+        # Nom ajouté par un autre worker depuis le chargement
+        model = TABLES[dimension]
+        with database.engine.connect() as conn:
+            id_ = conn.execute(select(model.id).where(model.name == name)).scalar()
+        if id_ is not None:
+            with _lock:
+                _remember(dimension, [(id_, name)])
+    return id_
+
+
+def ids_like(dimension: str, fragment: str):
+
+    #Identifiants dont le nom contient le fragment (insensible à la casse), résolus en mémoire
+    _ensure_loaded()
+    if _state["version"] != cache.get_data_version():
+        load()
+    fragment = fragment.lower()
+    return [id_ for name, id_ in _ids[dimension].items() if fragment in name.lower()]
+
+
+def equals(column, dimension: str, name: str):
+
+    #Filtre d'égalité sur un nom, traduit en comparaison d'entiers (aucune ligne si le nom est inconnu)
+    id_ = id_of(dimension, name)
+    return column == id_ if id_ is not None else false()
+
+
+def contains(column, dimension: str, fragment: str):
+
+    #Recherche partielle sur un nom, traduite en IN sur les identifiants correspondants
+    ids = ids_like(dimension, fragment)
+    return column.in_(ids) if ids else false()
+
+
+def api_field(column_name: str):
+
+    #Champ exposé par l'API pour une colonne : une dimension encodée (<nom>_id) l'est par son nom
+    return column_name[:-3] if column_name[:-3] in TABLES else column_name
+
+
+def sort_column(query, entity, field: str):
+
+    #Colonne de tri : une dimension encodée est triée par nom (jointure sur sa petite table)
+    if field in TABLES:
+        model = TABLES[field]
+        return query.join(model, model.id == getattr(entity, f"{field}_id")), model.name
+    return query, getattr(entity, field)
+
+
+def _create_ids(conn, dimension: str, names):
+
+    #Identifiants des noms donnés, en créant ceux qui manquent (dans la transaction de conn)
+    model = TABLES[dimension]
+    names = {n for n in names if n is not None}
+    if not names:
+        return {}
+    found = dict(conn.execute(select(model.name, model.id).where(model.name.in_(names))).all())
+    missing = names - found.keys()
+    if missing:
+        conn.execute(insert(model), [{"name": n} for n in sorted(missing)])
+        found.update(conn.execute(select(model.name, model.id).where(model.name.in_(missing))).all())
+    return found
+
+
+def get_or_create_ids(db: Session, dimension: str, names):
+
+    #Encoder des noms à l'écriture (chargeur, écritures en masse) ; les dictionnaires ne les apprennent qu'au commit
+    found = _create_ids(db.connection(), dimension, names)
+    db.info.setdefault("dimension_pairs", []).append((dimension, found))
+    return found
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_committed(session):
+    pending = session.info.pop("dimension_pairs", None)
+    if pending:
+        with _lock:
+            for dimension, found in pending:
+                _remember(dimension, [(id_, name) for name, id_ in found.items()])
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session):
+    # Identifiants d'une transaction annulée : SQLite les réattribuera à d'autres noms
+    session.info.pop("dimension_pairs", None)
+
+
+def _encode_table(conn, table_name: str, columns: list, lookup):
+
+    #Remplacer les colonnes texte d'une table par leurs identifiants (une passe UPDATE par colonne)
+    existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table_name})")}
+    legacy = [c for c in columns if c in existing]
+    if not legacy:
+        return False
+
+    # SQLite refuse DROP COLUMN sur une colonne indexée
+    for index in list(conn.exec_driver_sql(f"PRAGMA index_list({table_name})")):
+        indexed = {row[2] for row in conn.exec_driver_sql(f"PRAGMA index_info({index[1]})")}
+        if indexed & set(legacy) and index[3] == "c":
+            conn.exec_driver_sql(f"DROP INDEX {index[1]}")
+
+    for column in legacy:
+        if f"{column}_id" not in existing:
+            conn.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column}_id INTEGER")
+        names = [row[0] for row in conn.exec_driver_sql(
+            f"SELECT DISTINCT {column} FROM {table_name} WHERE {column} IS NOT NULL"
+        )]
+        mapping = lookup(column, names)
+        conn.exec_driver_sql("CREATE TEMP TABLE dimension_map (name TEXT PRIMARY KEY, id INTEGER NOT NULL)")
+        if mapping:
+            conn.exec_driver_sql("INSERT INTO temp.dimension_map (name, id) VALUES (?, ?)", list(mapping.items()))
+        conn.exec_driver_sql(
+            f"UPDATE {table_name} SET {column}_id = "
+            f"(SELECT id FROM temp.dimension_map WHERE name = {table_name}.{column})"
+        )
+        conn.exec_driver_sql("DROP TABLE temp.dimension_map")
+        conn.exec_driver_sql(f"ALTER TABLE {table_name} DROP COLUMN {column}")
+    return True
+
+
+def encode_legacy(bind):
+
+    #Migrer une base (et ses partitions) qui stocke encore les noms en texte ; sans effet ensuite
+    migrated = False
+    with bind.begin() as conn:
+        # Les compteurs sont reconstruits au préchauffage : les anciennes tables sont supprimées
+        for table in (EmissionCount.__table__, AirQualityCount.__table__):
+            existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+            if "country" in existing:
+                conn.exec_driver_sql(f"DROP TABLE {table.name}")
+        for table_name, columns in LEGACY_COLUMNS.items():
+            if _encode_table(conn, table_name, columns, lambda d, names: _create_ids(conn, d, names)):
+                migrated = True
+        partitions = [row[0] for row in conn.execute(select(EmissionPartition.filename))]
+
+    for filename in partitions:
+        part_engine = create_engine(f"sqlite:///{partition_path(filename)}")
+        with bind.begin() as main, part_engine.begin() as conn:
+            encoded = _encode_table(
+                conn, Emission.__tablename__, LEGACY_COLUMNS[Emission.__tablename__],
+                lambda d, names: _create_ids(main, d, names)
+            )
+            if encoded:
+                conn.exec_driver_sql(
+                    f"CREATE INDEX IF NOT EXISTS ix_partition_country_date ON {Emission.__tablename__} (country_id, date)"
+                )
+        if encoded:
+            _compact(part_engine)
+            migrated = True
+        else:
+            part_engine.dispose()
+
+    if migrated:
+        Base.metadata.create_all(bind=bind)
+        with bind.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+        load()
+        print("Base migrée : pays, villes et secteurs encodés en tables de dimensions")
+    return migrated
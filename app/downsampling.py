@@ -0,0 +1,84 @@
+import numpy as np
+
+
+# Réduction de séries temporelles pour les graphiques (côté serveur)
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int):
+
+    #Largest-Triangle-Three-Buckets : garde les points qui préservent la forme visuelle
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bornes des buckets intermédiaires (premier et dernier point toujours conservés)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+
+        # Moyenne du bucket suivant (le dernier point pour le dernier bucket)
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+
+        # Aire du triangle (point retenu précédent, candidat, moyenne suivante)
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+def bucket_aggregate(x: np.ndarray, y: np.ndarray, threshold: int):
+
+    #Agrégation min/max/moyenne par bucket de taille égale
+    n = len(x)
+    if threshold >= n:
+        return x, y, y, y
+
+    bucket = (np.arange(n) * threshold) // n
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    counts = np.diff(np.r_[starts, n])
+
+    avg = np.add.reduceat(y, starts) / counts
+    mins = np.minimum.reduceat(y, starts)
+    maxs = np.maximum.reduceat(y, starts)
+    # Abscisse du bucket : son premier point
+    return x[starts], avg, mins, maxs
+
+
+def downsample(dates: list, values: list, points: int = 1000, method: str = "lttb"):
+
+    #Réduire une série (dates, valeurs) à ~points éléments, prête pour Chart.js
+    if not dates:
+        return {"labels": [], "values": [], "total_points": 0}
+
+    x = np.array(dates, dtype="datetime64[D]")
+    y = np.asarray(values, dtype=np.float64)
+    xi = x.astype(np.int64)
+
+    if method == "bucket":
+        bx, avg, mins, maxs = bucket_aggregate(xi, y, points)
+        return {
+            "labels": np.asarray(bx, dtype="datetime64[D]").astype(str).tolist(),
+            "values": np.round(avg, 2).tolist(),
+            "min": np.round(mins, 2).tolist(),
+            "max": np.round(maxs, 2).tolist(),
+            "total_points": len(x)
+        }
+
+    idx = lttb(xi.astype(np.float64), y, points)
+    return {
+        "labels": x[idx].astype(str).tolist(),
+        "values": np.round(y[idx], 2).tolist(),
+        "total_points": len(x)
+    }
@@ -0,0 +1,122 @@
+import sqlite3
+import time
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+
+from app import dimensions, metrics
+from app.models import Emission
+from app.partitions import get_partitions, partition_path
+
+# Instructions de la machine virtuelle SQLite entre deux vérifications du budget
+PROGRESS_STEP = 1000
+
+# Budget d'une requête HTTP (toutes ses requêtes SQL cumulées), en milliers d'instructions et en secondes
+# (repère : une statistique sur toute la table des émissions coûte environ 1 200 milliers d'instructions)
+QUERY_BUDGET = {"steps": 50000, "timeout": 2.0}
+ADMIN_QUERY_BUDGET = {"steps": 2000000, "timeout": 30.0}
+
+
+class QueryBudget:
+
+    def __init__(self, steps: int, timeout: float):
+        self.remaining = steps
+        self.deadline = time.monotonic() + timeout
+        self.exceeded = None
+
+    def check(self):
+
+        #Appelé par SQLite toutes les PROGRESS_STEP instructions : une valeur non nulle interrompt la requête
+        if self.exceeded is None:
+            self.remaining -= 1
+            if self.remaining < 0:
+                self.exceeded = "steps"
+            elif time.monotonic() > self.deadline:
+                self.exceeded = "timeout"
+            if self.exceeded:
+                metrics.increment("query_guard_rejections_total", self.exceeded)
+        return 1 if self.exceeded else 0
+
+
+def limit(db: Session, admin: bool = False):
+
+    #Borner le coût des requêtes d'une session (à appeler avant sa première requête)
+    db.info["budget"] = QueryBudget(**(ADMIN_QUERY_BUDGET if admin else QUERY_BUDGET))
+    return db
+
+
+@event.listens_for(Session, "after_begin")
+def _install_budget(session, transaction, connection):
+    budget = session.info.get("budget")
+    if budget is not None:
+        connection.connection.dbapi_connection.set_progress_handler(budget.check, PROGRESS_STEP)
+
+
+@event.listens_for(Pool, "checkin")
+def _clear_budget(dbapi_connection, connection_record):
+    # Une connexion rendue au pool ne garde pas le budget de la requête précédente
+    if dbapi_connection is not None:
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+# Colonnes en tête d'un index, par fichier de partition (fichiers en lecture seule : lues une fois)
+_partition_heads = {}
+
+
+def _index_heads(path: str):
+    if path not in _partition_heads:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            table = Emission.__tablename__
+            heads = set()
+            for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+                heads.update(row[2] for row in conn.execute(f"PRAGMA index_info({index[1]})") if row[0] == 0)
+        finally:
+            conn.close()
+        _partition_heads[path] = heads
+    return _partition_heads[path]
+
+
+def sortable_fields(model, db: Session = None):
+
+    #Champs triables sans balayer la table : clé primaire ou tête d'un index, dans chaque partition aussi
+    # (un pays, une ville ou un secteur est trié par son nom, via une jointure : jamais servi par un index)
+    columns = list(model.__table__.primary_key.columns) + [index.columns[0] for index in model.__table__.indexes]
+    names = {column.name for column in columns if dimensions.api_field(column.name) == column.name}
+    if db is not None and model is Emission:
+        # Union avec les partitions : chaque branche doit pouvoir lire le champ dans l'ordre
+        primary = {column.name for column in model.__table__.primary_key.columns}
+        for p in get_partitions(db):
+            names &= _index_heads(partition_path(p.filename)) | primary
+    return names
+
+
+def check_order_by(model, order_by: str, admin: bool = False, db: Session = None):
+
+    #Refuser (422) un tri inconnu, ou un tri sur une colonne non indexée hors administrateurs
+    field = order_by.lstrip("-")
+    if field not in {dimensions.api_field(name) for name in model.__table__.columns.keys()}:
+        metrics.increment("query_guard_rejections_total", "order_by")
+        raise HTTPException(status_code=422, detail=f"Champ de tri inconnu : {field}")
+    allowed = sortable_fields(model, db)
+    if not admin and field not in allowed:
+        metrics.increment("query_guard_rejections_total", "order_by")
+        raise HTTPException(
+            status_code=422,
+            detail=f"Tri non indexé sur {field} réservé aux administrateurs (champs autorisés : {', '.join(sorted(allowed))})"
+        )
+
+
+def budget_exceeded_handler(request, exc: OperationalError):
+
+    #Requête interrompue par le budget : 503 explicite plutôt qu'un worker bloqué
+    if "interrupted" not in str(exc.orig):
+        raise exc
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Requête trop coûteuse : affiner les filtres (pays, ville, dates) ou réduire la période"},
+        headers={"Retry-After": "1"}
+    )
@@ -0,0 +1,183 @@
+import glob
+import os
+import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from sqlalchemy.orm import Session
+
+from app.cache import bump_data_version
+from app.changes import begin_bulk, end_bulk
+from app.crud import _encode_dimensions, _list_adapter, _validate_batch, _with_aqi
+from app.models import Emission, Global, IngestedShard
+from app.partitions import archived_years
+from app.schemas import EmissionCreate, GlobalCreate
+
+# Fichiers CSV livrés par l'amont : le type d'un fichier est reconnu à son en-tête
+SHARD_KINDS = {
+    "emission": {
+        "schema": EmissionCreate,
+        "columns": {"country": "country", "date": "date", "sector": "sector", "value": "value", "timestamp": "timestamp"},
+        "date_format": "%d/%m/%Y",
+    },
+    "air_quality": {
+        "schema": GlobalCreate,
+        "columns": {
+            "City": "city", "Country": "country", "Date": "date", "PM2.5": "pm25", "PM10": "pm10",
+            "NO2": "no2", "SO2": "so2", "CO": "co", "O3": "o3", "Temperature": "temperature",
+            "Humidity": "humidity", "Wind Speed": "wind_speed",
+        },
+        "date_format": "%Y-%m-%d",
+    },
+}
+
+# Lignes accumulées avant une écriture (une transaction, manifeste compris)
+WRITE_BATCH_SIZE = 50000
+
+# Fichiers analysés d'avance par worker : au-delà, l'analyse attend l'écrivain (mémoire bornée)
+PENDING_PER_WORKER = 2
+
+
+def find_shards(inputs: list):
+
+    #Fichiers CSV d'une liste de dossiers et de motifs glob, triés et sans doublons
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.csv")
+        paths.update(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+    return sorted(os.path.abspath(p) for p in paths)
+
+
+def _signature(path: str):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def parse_shard(path: str, source_ids: dict):
+
+    #Worker : lire, valider et convertir un fichier en tuples prêts à écrire (dates ISO, noms en clair)
+    data = pd.read_csv(path, dtype=str, keep_default_na=False)
+    kind = next((k for k, spec in SHARD_KINDS.items() if set(spec["columns"]) <= set(data.columns)), None)
+    if kind is None:
+        raise ValueError(f"{path} : en-tête non reconnu ({', '.join(data.columns)})")
+    spec = SHARD_KINDS[kind]
+
+    data = data[list(spec["columns"])].rename(columns=spec["columns"])
+    dates = pd.to_datetime(data["date"], format=spec["date_format"], errors="coerce")
+    data["date"] = dates.dt.strftime("%Y-%m-%d").where(dates.notna(), None)
+    data["source_id"] = source_ids[kind]
+    records = data.to_dict("records")
+
+    # Même validation que les écritures en masse ; les lignes invalides sont comptées puis écartées
+    schema = spec["schema"]
+    adapter = _list_adapter(schema)
+    errors = []
+    valid = [item for _, item in _validate_batch(adapter, schema, records, 0, errors)]
+    rows = [tuple(row[c] for c in schema.model_fields) for row in adapter.dump_python(valid, mode="json")]
+    return {"path": path, "kind": kind, "rows": rows, "read": len(records), "rejected": len(errors)}
+
+
+def _write_batch(db: Session, batch: list, archived: set):
+
+    #Écrivain unique : encoder, écrire les lignes nouvelles et le manifeste dans une seule transaction
+    conn = db.connection()
+    written = {}
+    for kind, table in (("emission", Emission.__table__), ("air_quality", Global.__table__)):
+        shards = [shard for shard in batch if shard["kind"] == kind]
+        rows = [row for shard in shards for row in shard["rows"]]
+        if not rows:
+            continue
+        columns, rows = _encode_dimensions(db, list(SHARD_KINDS[kind]["schema"].model_fields), rows)
+
+        if kind == "emission":
+            # Années archivées en lecture seule ; une ligne déjà présente (clé naturelle) est gardée telle quelle
+            day = columns.index("date")
+            rows = [row for row in rows if int(row[day][:4]) not in archived]
+            verb = "INSERT OR IGNORE"
+        else:
+            # Plusieurs mesures par ville et par jour sont possibles : toutes sont gardées
+            # (le manifeste évite déjà de relire un fichier chargé)
+            columns, rows = _with_aqi(columns, rows)
+            verb = "INSERT"
+
+        if rows:
+            # Journal des modifications : une seule écriture pour toute la plage d'ids insérés
+            last_id = begin_bulk(conn, table)
+            result = conn.exec_driver_sql(
+                f"{verb} INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+            )
+            end_bulk(conn, table, last_id)
+            # Lignes réellement insérées (hors lignes ignorées)
+            written[kind] = result.rowcount
+
+    for shard in batch:
+        size, mtime_ns = shard["signature"]
+        db.merge(IngestedShard(
+            path=shard["path"], kind=shard["kind"], size=size, mtime_ns=mtime_ns,
+            row_count=shard["read"], rejected=shard["rejected"], loaded_at=datetime.utcnow()
+        ))
+    db.commit()
+    return written
+
+
+def ingest_shards(db: Session, inputs: list, source_ids: dict, workers: int = None):
+
+    #Charger des fichiers en parallèle : analyse dans un pool de processus, écriture ordonnée par un seul écrivain
+    shards = [(path, _signature(path)) for path in find_shards(inputs)]
+    done = {(s.path, (s.size, s.mtime_ns)) for s in db.query(IngestedShard).all()}
+    todo = [shard for shard in shards if shard not in done]
+    print(f"{len(shards)} fichier(s) trouvé(s), {len(shards) - len(todo)} déjà chargé(s) d'après le manifeste")
+    if not todo:
+        return {"files": 0, "written": 0, "rejected": 0}
+
+    workers = workers or os.cpu_count() or 1
+    archived = archived_years(db)
+    totals = {"files": 0, "written": 0, "rejected": 0}
+    batch, batch_rows = [], 0
+
+    def flush():
+        written = _write_batch(db, batch, archived)
+        totals["written"] += sum(written.values())
+        totals["files"] += len(batch)
+        print(f"  {totals['files']}/{len(todo)} fichier(s) écrit(s), {totals['written']} ligne(s) nouvelle(s)")
+        # Les lecteurs (autres workers) voient les nouvelles lignes dès ce commit
+        bump_data_version()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # File bornée des analyses en cours, consommée dans l'ordre des fichiers
+        pending = deque()
+        remaining = iter(todo)
+        try:
+            while True:
+                for path, signature in remaining:
+                    pending.append((signature, pool.submit(parse_shard, path, source_ids)))
+                    if len(pending) >= workers * PENDING_PER_WORKER:
+                        break
+                if not pending:
+                    break
+                batch_rows = _collect(pending, batch, batch_rows, totals)
+                if batch_rows >= WRITE_BATCH_SIZE:
+                    flush()
+                    batch, batch_rows = [], 0
+            if batch:
+                flush()
+        except BaseException:
+            # Les lots déjà écrits restent au manifeste : une relance reprend au premier fichier non écrit
+            db.rollback()
+            for _, future in pending:
+                future.cancel()
+            raise
+
+    return totals
+
+
+def _collect(pending: deque, batch: list, batch_rows: int, totals: dict):
+
+    #Attendre le plus ancien fichier en cours et l'ajouter au lot à écrire
+    signature, future = pending.popleft()
+    shard = future.result()
+    shard["signature"] = signature
+    totals["rejected"] += shard["rejected"]
+    batch.append(shard)
+    return batch_rows + len(shard["rows"])
@@ -1,19 +1,50 @@
+import argparse
+import os
 import pandas as pd
 import sys
+import traceback
 from pathlib import Path
 from sqlalchemy.orm import Session
 from datetime import datetime
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from app.database import SessionLocal, engine
-from app.models import Emission, Global, Source, Base
+from app import database
+from app.database import SessionLocal
+from app.models import (
+    City, Country, Emission, EmissionPartition, Global, IngestedShard, Sector, Source, User, Base, ensure_aqi, ensure_schema
+)
+from app.partitions import archived_years, partition_path
+from app.cache import bump_data_version
+from app.counters import rebuild_counts
+from app.aqi import compute_aqi
+from app.dimensions import encode_legacy, get_or_create_ids
+from app.changes import begin_bulk, end_bulk, ensure_triggers, last_seq, record_reset, shift_sequence
+from app.ingest import ingest_shards
 
-Base.metadata.create_all(bind=engine)
+# Tables reprises de la base servie lors d'un rechargement (comptes, sources, dimensions, partitions et manifeste)
+CARRIED_TABLES = [User, Source, Country, City, Sector, EmissionPartition, IngestedShard]
 
-db = SessionLocal()
+# Faits repris eux aussi : les écritures en masse et les upserts ne sont pas dans les CSV
+FACT_TABLES = [Emission, Global]
 
-try:
+
+def load_all(db: Session, inputs: list = None, workers: int = None):
+
+    #Charger les sources, puis les émissions CO2 et la qualité de l'air (CSV par défaut ou fichiers donnés)
+    source_co2, source_air = _load_sources(db)
+    if inputs:
+        ingest_shards(db, inputs, {"emission": source_co2.id, "air_quality": source_air.id}, workers)
+    else:
+        _load_default_csv(db, source_co2, source_air)
+    
+    # Compteurs des totaux de pagination
+    rebuild_counts(db)
+
+
+def _load_sources(db: Session):
+
+    #Sources des deux jeux de données (créées au premier chargement)
     # CHARGER LES SOURCES
     source_co2 = db.query(Source).filter(Source.name == "CO2 Emissions Dataset").first()
     if not source_co2:
@@ -36,27 +67,40 @@ try:
         db.add(source_air)
         db.commit()
         db.refresh(source_air)
-    
+    return source_co2, source_air
+
+
+def _load_default_csv(db: Session, source_co2: Source, source_air: Source):
+
+    #Charger les deux CSV du dépôt ligne par ligne
     # CHARGER CO2 EMISSIONS
     data_co2 = pd.read_csv("data/co2_emissions_by_sector.csv")
     
     inserted_co2 = 0
     skipped_co2 = 0
+    # Les années archivées en partitions sont en lecture seule
+    archived = archived_years(db)
+    # Pays et secteurs encodés en identifiants (tables de dimensions)
+    countries = get_or_create_ids(db, "country", set(data_co2['country']))
+    sectors = get_or_create_ids(db, "sector", set(data_co2['sector']))
     
     for _, row in data_co2.iterrows():
         date_obj = datetime.strptime(row['date'], '%d/%m/%Y').date()
+        if date_obj.year in archived:
+            skipped_co2 += 1
+            continue
         
         existing = db.query(Emission).filter(
-            Emission.country == row['country'],
+            Emission.country_id == countries[row['country']],
             Emission.date == date_obj,
-            Emission.sector == row['sector']
+            Emission.sector_id == sectors[row['sector']]
         ).first()
         
         if not existing:
             emission = Emission(
-                country=row['country'],
+                country_id=countries[row['country']],
                 date=date_obj,
-                sector=row['sector'],
+                sector_id=sectors[row['sector']],
                 value=float(row['value']),
                 timestamp=int(row['timestamp']),
                 source_id=source_co2.id
@@ -76,20 +120,27 @@ try:
     
     inserted_air = 0
     skipped_air = 0
+    cities = get_or_create_ids(db, "city", set(data_air['City']))
+    countries = get_or_create_ids(db, "country", set(data_air['Country']))
+    # AQI calculé à l'insertion (vectorisé sur tout le fichier), comme pour l'ingestion en masse
+    data_air['AQI'] = compute_aqi(
+        pm25=data_air['PM2.5'], pm10=data_air['PM10'], no2=data_air['NO2'],
+        so2=data_air['SO2'], co=data_air['CO'], o3=data_air['O3']
+    )
     
     for _, row in data_air.iterrows():
         date_obj = datetime.strptime(row['Date'], '%Y-%m-%d').date()
         
         existing = db.query(Global).filter(
-            Global.city == row['City'],
-            Global.country == row['Country'],
+            Global.city_id == cities[row['City']],
+            Global.country_id == countries[row['Country']],
             Global.date == date_obj
         ).first()
         
         if not existing:
             air_quality = Global(
-                city=row['City'],
-                country=row['Country'],
+                city_id=cities[row['City']],
+                country_id=countries[row['Country']],
                 date=date_obj,
                 pm25=float(row['PM2.5']),
                 pm10=float(row['PM10']),
@@ -100,6 +151,7 @@ try:
                 temperature=float(row['Temperature']),
                 humidity=float(row['Humidity']),
                 wind_speed=float(row['Wind Speed']),
+                aqi=float(row['AQI']),
                 source_id=source_air.id
             )
             db.add(air_quality)
@@ -111,10 +163,184 @@ try:
             skipped_air += 1
     
     db.commit()
-    
-except Exception as e:
-    import traceback
-    traceback.print_exc()
-    db.rollback()
-finally:
-    db.close()
+
+
+def load_in_place(inputs: list = None, workers: int = None):
+
+    #Chargement direct dans la base servie (les lecteurs attendent les verrous d'écriture)
+    engine = database.engine
+    with database.schema_lock(engine):
+        Base.metadata.create_all(bind=engine)
+        encode_legacy(engine)
+        ensure_schema(engine)
+        ensure_aqi(engine)
+        ensure_triggers(engine)
+
+    db = SessionLocal()
+    try:
+        load_all(db, inputs, workers)
+        # Invalider le cache partagé de tous les workers
+        bump_data_version()
+    except Exception:
+        traceback.print_exc()
+        db.rollback()
+    finally:
+        db.close()
+
+
+def _attach_live(conn, live_path: str, alias: str = "live"):
+    conn.exec_driver_sql(f"ATTACH DATABASE ? AS {alias}", (Path(os.path.abspath(live_path)).as_uri() + "?mode=ro",))
+
+
+def _emission_id_floor(conn):
+
+    #Plus grand id d'émission de la base servie et de ses partitions (à attacher hors transaction)
+    table = Emission.__tablename__
+    floor = conn.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM live.{table}").scalar()
+    for (filename,) in conn.exec_driver_sql(f"SELECT filename FROM live.{EmissionPartition.__tablename__}").all():
+        _attach_live(conn, partition_path(filename), "part")
+        try:
+            floor = max(floor, conn.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM part.{table}").scalar())
+        finally:
+            conn.exec_driver_sql("DETACH DATABASE part")
+    return floor
+
+
+def _copy_carried_tables(staging, live_path: str):
+
+    #Reprendre les tables conservées et les faits depuis la base servie, attachée en lecture seule
+    with staging.connect() as conn:
+        _attach_live(conn, live_path)
+        try:
+            floor = _emission_id_floor(conn)
+            # Le journal des modifications continue la séquence de la base servie, par un "reset"
+            record_reset(conn, last_seq(conn, "live"))
+            for model in CARRIED_TABLES + FACT_TABLES:
+                table = model.__table__
+                columns = ", ".join(c.name for c in table.columns)
+                # Faits : journalisés d'un seul INSERT … SELECT plutôt que ligne à ligne
+                last_id = begin_bulk(conn, table) if model in FACT_TABLES else None
+                conn.exec_driver_sql(f"INSERT INTO main.{table.name} ({columns}) SELECT {columns} FROM live.{table.name}")
+                if last_id is not None:
+                    end_bulk(conn, table, last_id)
+            # Les nouvelles émissions prennent des ids au-delà de ceux des partitions archivées
+            name = Emission.__tablename__
+            if not conn.exec_driver_sql(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (floor, name)
+            ).rowcount:
+                conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (name, floor))
+            conn.commit()
+        finally:
+            conn.exec_driver_sql("DETACH DATABASE live")
+
+
+def _check_snapshot(staging):
+
+    #Refuser un instantané corrompu ou vide avant de le publier
+    with staging.connect() as conn:
+        check = conn.exec_driver_sql("PRAGMA quick_check").scalar()
+        if check != "ok":
+            raise ValueError(f"Instantané corrompu : {check}")
+        emissions = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {Emission.__tablename__}").scalar()
+        measures = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {Global.__tablename__}").scalar()
+        partitions = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {EmissionPartition.__tablename__}").scalar()
+    if not measures or not (emissions or partitions):
+        raise ValueError("Instantané vide : chargement abandonné")
+    return emissions, measures
+
+
+def _continue_sequence(staging, live_path: str):
+
+    #Garder le journal monotone si la base servie a reçu des écritures pendant le rechargement
+    with staging.connect() as conn:
+        _attach_live(conn, live_path)
+        try:
+            if shift_sequence(conn, last_seq(conn, "live")):
+                conn.commit()
+        finally:
+            conn.exec_driver_sql("DETACH DATABASE live")
+
+
+def publish_snapshot(path: str):
+
+    #Remplacer atomiquement le pointeur : les workers basculent à leur prochaine requête
+    tmp = database.CURRENT_POINTER + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(path)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, database.CURRENT_POINTER)
+
+
+def _remove_old_snapshots(keep: set):
+
+    #Supprimer les instantanés qui ne sont plus servis (le précédent est gardé pour les requêtes en cours)
+    keep = {os.path.abspath(p) for p in keep}
+    for name in os.listdir(database.SNAPSHOTS_DIR):
+        path = os.path.abspath(os.path.join(database.SNAPSHOTS_DIR, name))
+        if name.startswith("ecotrack-") and path not in keep and not any(path.startswith(k) for k in keep):
+            os.remove(path)
+
+
+def reload_snapshot(inputs: list = None, workers: int = None):
+
+    #Construire une nouvelle base complète à côté de la base servie, puis la publier d'un coup
+    os.makedirs(database.SNAPSHOTS_DIR, exist_ok=True)
+    live_path = database.current_path()
+    path = os.path.join(database.SNAPSHOTS_DIR, f"ecotrack-{datetime.now():%Y%m%d-%H%M%S}.db")
+    staging = database.make_engine(path)
+
+    try:
+        Base.metadata.create_all(bind=staging)
+        ensure_schema(staging)
+        ensure_triggers(staging)
+        _copy_carried_tables(staging, live_path)
+
+        db = SessionLocal(bind=staging)
+        try:
+            load_all(db, inputs, workers)
+        finally:
+            db.close()
+
+        with staging.connect() as conn:
+            # Statistiques de l'optimiseur de la base principale (les partitions attachées sont en lecture seule)
+            conn.exec_driver_sql("ANALYZE main")
+        emissions, measures = _check_snapshot(staging)
+    except Exception:
+        # Un chargement échoué n'est jamais publié
+        staging.dispose()
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        raise
+    _continue_sequence(staging, live_path)
+    staging.dispose()
+
+    publish_snapshot(path)
+    # Invalider le cache partagé de tous les workers
+    bump_data_version()
+    _remove_old_snapshots({path, live_path})
+    print(f"Instantané publié : {path} ({emissions} émissions, {measures} mesures)")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chargement des CSV EcoTrack")
+    parser.add_argument(
+        "--reload", action="store_true",
+        help="Construire un nouvel instantané puis basculer l'API dessus sans interruption"
+    )
+    parser.add_argument(
+        "--input", action="append",
+        help="Dossier ou motif glob de fichiers CSV (répétable) ; par défaut les deux CSV de data/"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Processus d'analyse des fichiers (par défaut : nombre de coeurs)"
+    )
+    args = parser.parse_args()
+
+    if args.reload:
+        reload_snapshot(args.input, args.workers)
+    else:
+        load_in_place(args.input, args.workers)
@@ -1,21 +1,47 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from app.database import Base, engine
-from app import models, routes
+from fastapi.responses import FileResponse, JSONResponse
+from sqlalchemy.exc import OperationalError
+from app.database import Base
+from app import admission, changes, database, dimensions, guard, models, routes, warmup
+from app.broadcaster import broadcaster
+from app.partitions import TooManyPartitions
 import os
 
-# Création des tables
-Base.metadata.create_all(bind=engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Création / vérification des tables au démarrage du worker (et non à l'import),
+    # un worker après l'autre : les suivants trouvent la base déjà prête
+    database.refresh_snapshot()
+    with database.schema_lock(database.engine):
+        Base.metadata.create_all(bind=database.engine)
+        dimensions.encode_legacy(database.engine)
+        models.ensure_schema(database.engine)
+        # Avant les triggers : sur une base jamais migrée, l'AQI calculé n'est pas journalisé comme modification
+        models.ensure_aqi(database.engine)
+        changes.ensure_triggers(database.engine)
+    # Préchauffage en arrière-plan : /health/ready répond 503 tant qu'il n'est pas terminé
+    warmup.start_background()
+    # Diffusion temps réel des nouvelles lignes (SSE / WebSocket)
+    broadcaster.start()
+    yield
+    await broadcaster.stop()
+
 
 # Création de l'application FastAPI
 app = FastAPI(
     title="EcoTrack API",
     description="API for tracking CO2 emissions and air quality data",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Limitation de débit par client et délestage (à l'intérieur du CORS pour que les 429/503 restent lisibles)
+app.middleware("http")(admission.admission_middleware)
+
 # Configuration CORS pour permettre les requêtes depuis le frontend
 app.add_middleware(
     CORSMiddleware,
@@ -23,11 +49,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Total-Count-Type"],
 )
 
+# Requête interrompue par le garde-fou de coût : 503 au lieu d'une erreur 500
+app.add_exception_handler(OperationalError, guard.budget_exceeded_handler)
+
+# Requête couvrant trop de partitions archivées : message explicite au lieu d'une erreur 500
+@app.exception_handler(TooManyPartitions)
+async def too_many_partitions_handler(request, exc: TooManyPartitions):
+    return JSONResponse(status_code=422, content={"detail": str(exc)})
+
 # Inclusion des routes API
 if hasattr(routes, 'router'):
-    app.include_router(routes.router)
+    app.include_router(routes.router, dependencies=[Depends(admission.record_queue_wait)])
 
 # Servir le frontend sur /dashboard
 frontend_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend")
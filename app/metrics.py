@@ -0,0 +1,44 @@
+import sqlite3
+import threading
+from collections import defaultdict
+
+from app import cache
+
+# Compteurs en mémoire du worker (exposés sur /metrics)
+_counters = defaultdict(int)
+_lock = threading.Lock()
+
+
+def _key(name: str, label: str = None):
+    return f"{name}{{{label}}}" if label else name
+
+
+def increment(name: str, label: str = None, value: int = 1):
+
+    #Incrémenter un compteur, éventuellement ventilé par label (ex : type de route)
+    key = _key(name, label)
+    with _lock:
+        _counters[key] += value
+
+
+def increment_shared(conn, name: str, label: str = None, value: int = 1):
+
+    #Incrémenter un compteur commun à tous les workers (fichier partagé du cache, connexion de l'appelant)
+    conn.execute(
+        "INSERT INTO counters (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = value + excluded.value",
+        (_key(name, label), value)
+    )
+
+
+def snapshot():
+
+    #Copie des compteurs courants : ceux du worker, plus ceux partagés par tous les workers
+    with _lock:
+        counters = dict(_counters)
+    try:
+        for key, value in cache._connect().execute("SELECT key, value FROM counters"):
+            counters[key] = counters.get(key, 0) + value
+    except sqlite3.Error:
+        # Fichier partagé indisponible : compteurs du worker seulement
+        pass
+    return dict(sorted(counters.items()))
@@ -1,19 +1,62 @@
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, inspect
+from sqlalchemy.orm import Session, relationship
 from app.database import Base
+from app import metrics
 from datetime import datetime
 
+def _dimension_name(dimension: str):
+
+    #Propriété en lecture : nom d'une dimension encodée (dictionnaire en mémoire)
+    def getter(self):
+        from app.dimensions import name_of
+        return name_of(dimension, getattr(self, f"{dimension}_id"))
+    return property(getter)
+
+
+# Tables de dimensions : chaque pays, ville ou secteur est stocké une fois, les faits gardent l'identifiant
+class Country(Base):
+    __tablename__ = "countries"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class City(Base):
+    __tablename__ = "cities"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class Sector(Base):
+    __tablename__ = "sectors"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
 # Modèle Emissions pour CO2 Emissions by sector
 class Emission(Base):
     __tablename__ = "co2_emissions_by_sector"
+    # Clé naturelle (une valeur par pays, date et secteur) : sert aux upserts en masse
+    # AUTOINCREMENT : un id n'est jamais réutilisé, même après l'archivage des dernières lignes en partition
+    __table_args__ = (
+        Index("ux_emission_country_date_sector", "country_id", "date", "sector_id", unique=True),
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    country = Column(String, index=True)
-    date = Column(Date)
-    sector = Column(String)
+    country_id = Column(Integer, ForeignKey("countries.id"), index=True)
+    # Index sur la date : tri chronologique de la liste sans balayer la table
+    date = Column(Date, index=True)
+    sector_id = Column(Integer, ForeignKey("sectors.id"))
     value = Column(Float)
     timestamp = Column(Integer)
 
+    # Noms exposés par l'API
+    country = _dimension_name("country")
+    sector = _dimension_name("sector")
+
     # Relation vers la source
     source_id = Column(Integer, ForeignKey("sources.id"))
     source = relationship("Source", back_populates="emissions")
@@ -22,10 +65,12 @@ class Emission(Base):
 # Modèle Global pour Global air quality
 class Global(Base):
     __tablename__ = "global_air_quality"
+    # Classement des villes d'une date par AQI : parcours d'index, sans tri
+    __table_args__ = (Index("ix_global_date_aqi", "date", "aqi"),)
 
     id = Column(Integer, primary_key=True, index=True)
-    city = Column(String, index=True)
-    country = Column(String, index=True)
+    city_id = Column(Integer, ForeignKey("cities.id"), index=True)
+    country_id = Column(Integer, ForeignKey("countries.id"), index=True)
     date = Column(Date)
 
     pm25 = Column(Float)
@@ -39,6 +84,13 @@ class Global(Base):
     humidity = Column(Float)
     wind_speed = Column(Float)
 
+    # Indice de qualité de l'air (max des sous-indices des six polluants), calculé à l'ingestion
+    aqi = Column(Float, index=True)
+
+    # Noms exposés par l'API
+    city = _dimension_name("city")
+    country = _dimension_name("country")
+
     # Relation vers source
     source_id = Column(Integer, ForeignKey("sources.id"))
     source = relationship("Source", back_populates="global_data")
@@ -68,3 +120,111 @@ class Source(Base):
     # Relations vers les datasets
     emissions = relationship("Emission", back_populates="source")
     global_data = relationship("Global", back_populates="source")
+
+
+# Modèle EmissionPartition : partitions archivées (fichiers SQLite) des émissions
+class EmissionPartition(Base):
+    __tablename__ = "emission_partitions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    filename = Column(String, nullable=False)
+    year_from = Column(Integer, nullable=False)
+    year_to = Column(Integer, nullable=False)
+    date_min = Column(Date)
+    date_max = Column(Date)
+    row_count = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Manifeste du chargeur de fichiers : un fichier déjà écrit n'est pas rechargé (reprise après interruption)
+class IngestedShard(Base):
+    __tablename__ = "ingested_shards"
+
+    path = Column(String, primary_key=True)
+    kind = Column(String, nullable=False)  # emission, air_quality
+    size = Column(Integer, nullable=False)
+    mtime_ns = Column(Integer, nullable=False)  # un fichier modifié depuis son chargement est relu
+    row_count = Column(Integer)
+    rejected = Column(Integer)
+    loaded_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Compteurs de lignes par (pays, secteur, mois) : totaux de pagination sans COUNT(*)
+class EmissionCount(Base):
+    __tablename__ = "emission_counts"
+
+    country_id = Column(Integer, primary_key=True)
+    sector_id = Column(Integer, primary_key=True)
+    month = Column(String, primary_key=True)  # YYYY-MM
+    count = Column(Integer, nullable=False, default=0)
+
+
+# Compteurs de lignes par (pays, ville, mois)
+class AirQualityCount(Base):
+    __tablename__ = "air_quality_counts"
+
+    country_id = Column(Integer, primary_key=True)
+    city_id = Column(Integer, primary_key=True)
+    month = Column(String, primary_key=True)  # YYYY-MM
+    count = Column(Integer, nullable=False, default=0)
+
+
+# Journal des modifications (inserts, mises à jour, suppressions) : alimenté par des triggers SQLite
+class Change(Base):
+    __tablename__ = "changes"
+    # AUTOINCREMENT : un numéro de séquence n'est jamais réutilisé
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)  # emission, air_quality, source (ou "all" pour un rechargement complet)
+    row_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # insert, update, delete, reset
+
+
+def ensure_schema(bind):
+
+    #Ajouter colonnes et index des modèles sur une base existante (create_all ne le fait pas)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspect(bind).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                with bind.begin() as conn:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"
+                    )
+        for index in table.indexes:
+            if index.unique and not inspect(bind).has_index(table.name, index.name):
+                _drop_duplicates(bind, table, index)
+            # Une erreur ici arrête le démarrage : un index manquant fausserait les upserts
+            index.create(bind=bind, checkfirst=True)
+
+
+def _drop_duplicates(bind, table, index):
+
+    #Avant de créer un index unique : ne garder que la dernière ligne écrite de chaque clé (comme un upsert)
+    key = [c.name for c in index.columns]
+    complete = " AND ".join(f"{c} IS NOT NULL" for c in key)
+    with bind.begin() as conn:
+        removed = conn.exec_driver_sql(
+            f"DELETE FROM {table.name} WHERE {complete} AND id NOT IN "
+            f"(SELECT MAX(id) FROM {table.name} WHERE {complete} GROUP BY {', '.join(key)})"
+        ).rowcount
+    if removed:
+        metrics.increment("schema_duplicates_removed_total", index.name, removed)
+
+
+def ensure_aqi(bind):
+
+    #Migration unique : AQI des mesures enregistrées avant l'ajout de la colonne (NumPy importé seulement si nécessaire)
+    db = Session(bind=bind)
+    try:
+        if db.query(Global.id).filter(Global.aqi.is_(None)).first() is None:
+            return 0
+        from app.aqi import backfill_aqi
+        from app.cache import bump_data_version
+        updated = backfill_aqi(db)
+        bump_data_version()
+        return updated
+    finally:
+        db.close()
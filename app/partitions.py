@@ -0,0 +1,304 @@
+import argparse
+import os
+import sys
+from datetime import date
+from pathlib import Path
+from sqlalchemy import column, create_engine, select, table, union_all
+from sqlalchemy.orm import Session, aliased
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.database import Base, SessionLocal, engine
+from app.models import Change, Emission, EmissionPartition
+
+# Dossier des partitions archivées (un fichier SQLite par année ou plage d'années)
+PARTITIONS_DIR = "./partitions"
+
+# SQLite autorise 10 bases attachées par connexion (SQLITE_MAX_ATTACHED)
+MAX_ATTACHED = 10
+
+_partition_tables = {}
+
+
+class TooManyPartitions(ValueError):
+    # Requête qui devrait attacher plus de MAX_ATTACHED partitions
+    pass
+
+
+def partition_alias(name: str):
+
+    #Nom de schéma SQLite d'une partition attachée
+    return "p_" + name.replace("-", "_")
+
+
+def partition_path(filename: str):
+
+    #Chemin absolu du fichier d'une partition
+    return os.path.abspath(os.path.join(PARTITIONS_DIR, filename))
+
+
+def partition_table(name: str):
+
+    #Table légère (schéma de la partition attachée) avec les colonnes d'Emission
+    if name not in _partition_tables:
+        _partition_tables[name] = table(
+            Emission.__tablename__,
+            *[column(c.name, c.type) for c in Emission.__table__.columns],
+            schema=partition_alias(name)
+        )
+    return _partition_tables[name]
+
+
+def get_partitions(db: Session):
+
+    #Liste des partitions archivées
+    return db.query(EmissionPartition).order_by(EmissionPartition.year_from).all()
+
+
+def archived_years(db: Session):
+
+    #Années déjà déplacées dans une partition (en lecture seule)
+    return _covered_years(get_partitions(db))
+
+
+def _covered_years(partitions: list):
+
+    #Ensemble des années couvertes par une liste de partitions
+    years = set()
+    for p in partitions:
+        years.update(range(p.year_from, p.year_to + 1))
+    return years
+
+
+def prune_partitions(partitions: list, date_from: date = None, date_to: date = None):
+
+    #Ne garder que les partitions qui recoupent [date_from, date_to]
+    return [
+        p for p in partitions
+        if (date_from is None or p.date_max is None or p.date_max >= date_from)
+        and (date_to is None or p.date_min is None or p.date_min <= date_to)
+    ]
+
+
+def attach_partitions(db: Session, partitions: list):
+
+    #Attacher en lecture seule les partitions nécessaires sur la connexion de la session
+    conn = db.connection()
+    attached = conn.info.setdefault("emission_partitions", set())
+    needed = {p.name for p in partitions}
+
+    if len(needed) > MAX_ATTACHED:
+        raise TooManyPartitions(
+            f"La requête couvre {len(needed)} partitions (maximum {MAX_ATTACHED}) : "
+            "préciser date_from/date_to ou compacter les archives"
+        )
+
+    if len(attached | needed) > MAX_ATTACHED:
+        for name in list(attached - needed):
+            conn.exec_driver_sql(f"DETACH DATABASE {partition_alias(name)}")
+            attached.discard(name)
+
+    for p in partitions:
+        if p.name not in attached:
+            uri = Path(partition_path(p.filename)).as_uri() + "?mode=ro"
+            conn.exec_driver_sql(f"ATTACH DATABASE ? AS {partition_alias(p.name)}", (uri,))
+            attached.add(p.name)
+
+
+def emission_source(db: Session, date_from: date = None, date_to: date = None):
+
+    #Entité Emission à interroger : table principale + partitions non élaguées par les dates
+    all_partitions = get_partitions(db)
+    partitions = prune_partitions(all_partitions, date_from, date_to)
+    if not partitions:
+        return Emission
+
+    attach_partitions(db, partitions)
+
+    # La table principale est ignorée si toute la période est archivée
+    sources = [partition_table(p.name) for p in partitions]
+    if not (date_from and date_to and
+            set(range(date_from.year, date_to.year + 1)) <= _covered_years(all_partitions)):
+        sources.insert(0, Emission.__table__)
+
+    branches = []
+    for t in sources:
+        branch = select(*[t.c[c.name] for c in Emission.__table__.columns])
+        if date_from:
+            branch = branch.where(t.c.date >= date_from)
+        if date_to:
+            branch = branch.where(t.c.date <= date_to)
+        branches.append(branch)
+
+    return aliased(Emission, union_all(*branches).subquery("emissions_routed"), adapt_on_names=True)
+
+
+def _create_partition_file(filename: str):
+
+    #Créer le fichier d'une partition avec le schéma et les index d'Emission
+    os.makedirs(PARTITIONS_DIR, exist_ok=True)
+    path = partition_path(filename)
+    if os.path.exists(path):
+        raise ValueError(f"La partition {filename} existe déjà")
+
+    part_engine = create_engine(f"sqlite:///{path}")
+    # Le schéma d'Emission inclut ses index (date, pays, clé naturelle)
+    Emission.__table__.create(bind=part_engine)
+    with part_engine.begin() as conn:
+        conn.exec_driver_sql(
+            f"CREATE INDEX ix_partition_country_date ON {Emission.__tablename__} (country_id, date)"
+        )
+    return path, part_engine
+
+
+def _compact(part_engine):
+
+    #Compacter une partition (ANALYZE + VACUUM) avant de la passer en lecture seule
+    with part_engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+        conn.exec_driver_sql("VACUUM")
+    part_engine.dispose()
+
+
+def archive_year(year: int):
+
+    #Déplacer une année de la table principale vers sa propre partition
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if year in archived_years(db):
+            raise ValueError(f"L'année {year} est déjà archivée")
+    finally:
+        db.close()
+
+    name = str(year)
+    filename = f"co2_emissions_{name}.db"
+    path, part_engine = _create_partition_file(filename)
+    columns = ", ".join(c.name for c in Emission.__table__.columns)
+    table_name = Emission.__tablename__
+    bounds = (date(year, 1, 1), date(year, 12, 31))
+
+    try:
+        with engine.connect() as conn:
+            conn.exec_driver_sql("ATTACH DATABASE ? AS archive", (path,))
+            try:
+                conn.exec_driver_sql(
+                    f"INSERT INTO archive.{table_name} ({columns}) "
+                    f"SELECT {columns} FROM main.{table_name} WHERE date >= ? AND date <= ? ORDER BY date, id",
+                    bounds
+                )
+                row_count, date_min, date_max = conn.exec_driver_sql(
+                    f"SELECT COUNT(*), MIN(date), MAX(date) FROM archive.{table_name}"
+                ).one()
+                before = conn.exec_driver_sql(f"SELECT COALESCE(MAX(seq), 0) FROM main.{Change.__tablename__}").scalar()
+                conn.exec_driver_sql(
+                    f"DELETE FROM main.{table_name} WHERE date >= ? AND date <= ?", bounds
+                )
+                # Les lignes sont déplacées, pas supprimées : le journal des modifications n'en garde pas trace
+                conn.exec_driver_sql(
+                    f"DELETE FROM main.{Change.__tablename__} WHERE seq > ? AND entity = 'emission' AND op = 'delete'",
+                    (before,)
+                )
+                conn.execute(EmissionPartition.__table__.insert().values(
+                    name=name, filename=filename, year_from=year, year_to=year,
+                    date_min=date.fromisoformat(date_min) if date_min else None,
+                    date_max=date.fromisoformat(date_max) if date_max else None,
+                    row_count=row_count
+                ))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.exec_driver_sql("DETACH DATABASE archive")
+    except Exception:
+        part_engine.dispose()
+        os.remove(path)
+        raise
+
+    _compact(part_engine)
+
+    # Rester sous la limite d'attachement : fusionner les deux plus anciennes partitions
+    db = SessionLocal()
+    try:
+        partitions = get_partitions(db)
+    finally:
+        db.close()
+    if len(partitions) > MAX_ATTACHED:
+        merged = compact_partitions(partitions[0].year_from, partitions[1].year_to)
+        print(f"Plus de {MAX_ATTACHED} partitions : {partitions[0].name} et {partitions[1].name} fusionnées en {merged}")
+    return row_count
+
+
+def compact_partitions(year_from: int, year_to: int):
+
+    #Fusionner les partitions comprises dans [year_from, year_to] en un seul fichier
+    db = SessionLocal()
+    try:
+        partitions = [
+            p for p in get_partitions(db)
+            if p.year_from >= year_from and p.year_to <= year_to
+        ]
+    finally:
+        db.close()
+    if len(partitions) < 2:
+        raise ValueError("Au moins deux partitions sont nécessaires pour compacter")
+
+    name = f"{partitions[0].year_from}-{partitions[-1].year_to}"
+    filename = f"co2_emissions_{name}.db"
+    path, part_engine = _create_partition_file(filename)
+    columns = ", ".join(c.name for c in Emission.__table__.columns)
+    table_name = Emission.__tablename__
+
+    with part_engine.connect() as conn:
+        for p in partitions:
+            conn.exec_driver_sql("ATTACH DATABASE ? AS src", (partition_path(p.filename),))
+            conn.exec_driver_sql(
+                f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM src.{table_name} ORDER BY date, id"
+            )
+            conn.commit()
+            conn.exec_driver_sql("DETACH DATABASE src")
+    _compact(part_engine)
+
+    with engine.begin() as conn:
+        conn.execute(EmissionPartition.__table__.delete().where(
+            EmissionPartition.__table__.c.id.in_([p.id for p in partitions])
+        ))
+        conn.execute(EmissionPartition.__table__.insert().values(
+            name=name, filename=filename,
+            year_from=partitions[0].year_from, year_to=partitions[-1].year_to,
+            date_min=min(p.date_min for p in partitions if p.date_min),
+            date_max=max(p.date_max for p in partitions if p.date_max),
+            row_count=sum(p.row_count or 0 for p in partitions)
+        ))
+
+    # Les anciens fichiers peuvent encore être attachés par un worker en cours
+    for p in partitions:
+        try:
+            os.remove(partition_path(p.filename))
+        except OSError:
+            print(f"Impossible de supprimer {p.filename} (encore utilisé ?)")
+    return name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partitions annuelles des émissions CO2")
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive_cmd = commands.add_parser("archive", help="Archiver une année dans sa partition")
+    archive_cmd.add_argument("year", type=int)
+    compact_cmd = commands.add_parser("compact", help="Fusionner des partitions archivées")
+    compact_cmd.add_argument("year_from", type=int)
+    compact_cmd.add_argument("year_to", type=int)
+    commands.add_parser("list", help="Lister les partitions")
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        print(f"{archive_year(args.year)} émissions archivées pour {args.year}")
+    elif args.command == "compact":
+        print(f"Partition {compact_partitions(args.year_from, args.year_to)} créée")
+    else:
+        Base.metadata.create_all(bind=engine)
+        db = SessionLocal()
+        for p in get_partitions(db):
+            print(f"{p.name}: {p.row_count} lignes ({p.date_min} -> {p.date_max}) {p.filename}")
+        db.close()
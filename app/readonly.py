@@ -0,0 +1,57 @@
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import dimensions
+
+# Lignes des lectures publiques : tuples nommés (immuables, sans __dict__) au lieu d'instances ORM,
+# donc ni carte d'identité, ni suivi des modifications, ni relations chargées à la demande
+_row_types = {}
+
+
+def mark(db: Session):
+
+    #Passer une session en lecture seule : les listes sont lues en tuples, toute écriture est refusée
+    db.info["readonly"] = True
+    db.autoflush = False
+    return db
+
+
+def is_readonly(db: Session):
+    return db.info.get("readonly", False)
+
+
+@event.listens_for(Session, "before_flush")
+def _refuse_flush(session, flush_context, instances):
+    if session.info.get("readonly"):
+        raise RuntimeError("Session en lecture seule : écriture refusée")
+
+
+def row_type(model):
+
+    #Tuple nommé des champs exposés d'un modèle (mêmes noms que ses attributs lus par les schémas)
+    if model not in _row_types:
+        fields = [dimensions.api_field(c.name) for c in model.__table__.columns]
+        _row_types[model] = namedtuple(f"{model.__name__}Row", fields)
+    return _row_types[model]
+
+
+def fetch_rows(query, entity, model):
+
+    #Exécuter une requête ORM en tuples Core (colonnes du modèle) puis décoder les dimensions
+    columns = [c.key for c in model.__table__.columns]
+    make = row_type(model)._make
+    decode = [
+        (i, dimensions.api_field(name)) for i, name in enumerate(columns) if dimensions.api_field(name) != name
+    ]
+    rows = query.with_entities(*[getattr(entity, name) for name in columns]).all()
+    if not decode:
+        return [make(row) for row in rows]
+
+    result = []
+    for row in rows:
+        values = list(row)
+        for i, dimension in decode:
+            values[i] = dimensions.name_of(dimension, values[i])
+        result.append(make(values))
+    return result
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+# Fenêtres glissantes et variations annuelles sur une série journalière (calculs vectorisés)
+def daily_grid(dates, values):
+
+    #Projeter la série sur une grille de jours continue (jours sans donnée = NaN)
+    days = np.asarray(dates, dtype="datetime64[D]")
+    grid = np.arange(days[0], days[-1] + 1, dtype="datetime64[D]")
+    filled = np.full(len(grid), np.nan)
+    filled[(days - days[0]).astype(np.int64)] = np.asarray(values, dtype=np.float64)
+    return grid, filled
+
+
+def moving_average(values: np.ndarray, window: int):
+
+    #Moyenne glissante sur `window` jours par différence de sommes cumulées (jours manquants ignorés)
+    present = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(present, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(present)))
+    start = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+    end = np.arange(1, len(values) + 1)
+    n = counts[end] - counts[start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, (sums[end] - sums[start]) / n, np.nan)
+
+
+def rolling_max(values: np.ndarray, window: int):
+
+    #Maximum glissant sur `window` jours (vue glissante, sans copie des fenêtres)
+    padded = np.concatenate((np.full(window - 1, -np.inf), np.where(np.isnan(values), -np.inf, values)))
+    result = np.lib.stride_tricks.sliding_window_view(padded, window).max(axis=1)
+    return np.where(np.isinf(result), np.nan, result)
+
+
+def year_ago_index(grid: np.ndarray):
+
+    #Position du même jour un an plus tôt (29 février -> 28 février), -1 si hors de la grille
+    months = grid.astype("datetime64[M]")
+    day = (grid - months.astype("datetime64[D]")).astype(np.int64)
+    previous_month = months - 12
+    last_day = (previous_month + 1).astype("datetime64[D]") - 1
+    previous = np.minimum(previous_month.astype("datetime64[D]") + day, last_day)
+    index = (previous - grid[0]).astype(np.int64)
+    return np.where(index >= 0, index, -1)
+
+
+def yoy_percent(values: np.ndarray, grid: np.ndarray):
+
+    #Variation en % par rapport au même jour de l'année précédente
+    index = year_ago_index(grid)
+    previous = np.where(index >= 0, values[np.maximum(index, 0)], np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        change = (values - previous) / np.abs(previous) * 100
+    return np.where(np.isfinite(change), change, np.nan)
+
+
+def _to_list(values: np.ndarray):
+    return [None if np.isnan(v) else round(float(v), 2) for v in values]
+
+
+def rolling_stats(dates: list, values: list, windows: list, start=None):
+
+    #Moyennes et maxima glissants + variation annuelle, en une passe par série
+    if not dates:
+        return {"labels": [], "values": [], "windows": {str(w): {"avg": [], "max": []} for w in windows}, "yoy_pct": []}
+
+    grid, filled = daily_grid(dates, values)
+    stats = {w: (moving_average(filled, w), rolling_max(filled, w)) for w in windows}
+    yoy = yoy_percent(filled, grid)
+
+    # Ne renvoyer que les jours demandés ayant une donnée (l'historique antérieur sert aux fenêtres)
+    keep = ~np.isnan(filled)
+    if start is not None:
+        keep &= grid >= np.datetime64(start, "D")
+
+    return {
+        "labels": [str(d) for d in grid[keep]],
+        "values": _to_list(filled[keep]),
+        "windows": {str(w): {"avg": _to_list(avg[keep]), "max": _to_list(mx[keep])} for w, (avg, mx) in stats.items()},
+        "yoy_pct": _to_list(yoy[keep])
+    }
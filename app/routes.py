@@ -1,12 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Form
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Form, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import date, datetime, timedelta
 from jose import JWTError, jwt
+import asyncio
+import json
 
 from app.database import get_db
-from app import crud, schemas
+from app import cache, crud, guard, metrics, models, readonly, schemas, warmup
+from app.broadcaster import broadcaster
 
 router = APIRouter()
 security = HTTPBearer()
@@ -15,6 +20,15 @@ SECRET_KEY = "keep_it_secret"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Nombre maximum de lignes par requête d'écriture en masse
+BULK_MAX_RECORDS = 100000
+
+# Délai entre deux commentaires keep-alive du flux SSE (secondes)
+STREAM_KEEPALIVE = 15
+
+# Nombre maximum de fenêtres glissantes par requête
+ROLLING_MAX_WINDOWS = 4
+
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
@@ -48,9 +62,100 @@ def get_current_active_admin(user=Depends(verify_token)):
     return user
 
 
+def is_admin(request: Request):
+
+    #Rôle admin lu dans le JWT s'il est fourni et valide (routes publiques, sans exiger de token)
+    auth = request.headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        try:
+            return jwt.decode(auth[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("role") == "admin"
+        except JWTError:
+            pass
+    return False
+
+
+def get_guarded_db(request: Request, db: Session = Depends(get_db)):
+
+    #Session des lectures à filtres libres : en lecture seule, bornée par un budget de coût (plus large pour un admin)
+    return readonly.mark(guard.limit(db, admin=is_admin(request)))
+
+
+async def read_bulk_records(request: Request):
+
+    #Lire un tableau JSON ou un flux NDJSON (une ligne JSON par enregistrement)
+    content_type = request.headers.get("content-type", "")
+    records = []
+
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            records.extend(_parse_ndjson_lines(lines))
+            if len(records) > BULK_MAX_RECORDS:
+                break
+        records.extend(_parse_ndjson_lines([buffer]))
+    else:
+        try:
+            records = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Corps JSON invalide")
+        if not isinstance(records, list):
+            raise HTTPException(status_code=400, detail="Un tableau JSON d'enregistrements est attendu")
+
+    if len(records) > BULK_MAX_RECORDS:
+        raise HTTPException(status_code=413, detail=f"Maximum {BULK_MAX_RECORDS} enregistrements par requête")
+    return records
+
+
+def _parse_ndjson_lines(lines: list):
+
+    #Décoder des lignes NDJSON ; une ligne illisible devient un enregistrement invalide (erreur par ligne)
+    records = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            records.append(None)
+    return records
+
+
+# HEALTH
+@router.get("/health/live", tags=["Health"])
+def health_live():
+    #Le processus répond (liveness)
+    return {"status": "alive"}
+
+
+@router.get("/health/ready", tags=["Health"])
+def health_ready():
+    #Le worker est préchauffé et peut recevoir du trafic (readiness)
+    if not warmup.is_ready():
+        return JSONResponse(status_code=503, content={"status": "warming_up"}, headers={"Retry-After": "1"})
+    return {"status": "ready", "warmup_seconds": warmup.status["duration"], "warmup_error": warmup.status["error"]}
+
+
+def set_total_headers(response: Response, total: int, kind: str):
+
+    #Total pour la pagination, exact ou estimé à partir des compteurs
+    response.headers["X-Total-Count"] = str(total)
+    response.headers["X-Total-Count-Type"] = kind
+    return response
+
+
+@router.get("/metrics", tags=["Health"])
+def get_metrics():
+    #Compteurs du worker, plus ceux communs à tous les workers (requêtes limitées, délestées)
+    return metrics.snapshot()
+
+
 # EMISSIONS CO2
 @router.get("/emissions", response_model=List[schemas.EmissionResponse], tags=["Emissions"])
 def get_emissions(
+    request: Request,
     skip: int = Query(0, ge=0, description="Nombre d'éléments à sauter"),
     limit: int = Query(100, ge=1, le=1000, description="Nombre maximum d'éléments à retourner"),
     country: Optional[str] = Query(None, description="Filtrer par pays"),
@@ -58,7 +163,8 @@ def get_emissions(
     date_from: Optional[date] = Query(None, description="Date de début (YYYY-MM-DD)"),
     date_to: Optional[date] = Query(None, description="Date de fin (YYYY-MM-DD)"),
     order_by: Optional[str] = Query(None, description="Champ de tri (préfixer par '-' pour décroissant)"),
-    db: Session = Depends(get_db)
+    include_total: bool = Query(False, description="Ajouter le total dans l'en-tête X-Total-Count"),
+    db: Session = Depends(get_guarded_db)
 ):
     #Récupérer la liste des émissions CO2 avec filtres optionnels
     filters = {}
@@ -71,9 +177,31 @@ def get_emissions(
     if date_to:
         filters["date_to"] = date_to
     if order_by:
+        guard.check_order_by(models.Emission, order_by, admin=is_admin(request), db=db)
         filters["order_by"] = order_by
     
-    return crud.get_emissions(db, skip=skip, limit=limit, filters=filters)
+    response = cache.lookup(request)
+    if not response:
+        emissions = crud.get_emissions(db, skip=skip, limit=limit, filters=filters)
+        response = cache.store(request, emissions, List[schemas.EmissionResponse])
+
+    if include_total:
+        set_total_headers(response, *crud.count_emissions(db, filters))
+    return response
+
+
+@router.post("/emissions/bulk", tags=["Emissions"])
+async def bulk_emissions(
+    request: Request,
+    user=Depends(get_current_active_admin),
+    db: Session = Depends(get_db)
+):
+    #Insérer / mettre à jour des émissions en masse (JSON ou NDJSON, admin uniquement)
+    records = await read_bulk_records(request)
+    result = await run_in_threadpool(crud.bulk_upsert_emissions, db, records)
+    if result["written"]:
+        broadcaster.notify()
+    return result
 
 
 @router.get("/emissions/{emission_id}", response_model=schemas.EmissionResponse, tags=["Emissions"])
@@ -88,6 +216,7 @@ def get_emission(emission_id: int, db: Session = Depends(get_db)):
 # AIR QUALITY
 @router.get("/air-quality", response_model=List[schemas.GlobalResponse], tags=["Air Quality"])
 def get_air_quality(
+    request: Request,
     skip: int = Query(0, ge=0, description="Nombre d'éléments à sauter"),
     limit: int = Query(100, ge=1, le=1000, description="Nombre maximum d'éléments à retourner"),
     city: Optional[str] = Query(None, description="Filtrer par ville"),
@@ -95,7 +224,8 @@ def get_air_quality(
     date_from: Optional[date] = Query(None, description="Date de début (YYYY-MM-DD)"),
     date_to: Optional[date] = Query(None, description="Date de fin (YYYY-MM-DD)"),
     order_by: Optional[str] = Query(None, description="Champ de tri (préfixer par '-' pour décroissant)"),
-    db: Session = Depends(get_db)
+    include_total: bool = Query(False, description="Ajouter le total dans l'en-tête X-Total-Count"),
+    db: Session = Depends(get_guarded_db)
 ):
     #Récupérer la liste des mesures de qualité d'air avec filtres optionnels
     filters = {}
@@ -108,9 +238,88 @@ def get_air_quality(
     if date_to:
         filters["date_to"] = date_to
     if order_by:
+        guard.check_order_by(models.Global, order_by, admin=is_admin(request), db=db)
         filters["order_by"] = order_by
     
-    return crud.get_air_quality(db, skip=skip, limit=limit, filters=filters)
+    response = cache.lookup(request)
+    if not response:
+        air_quality = crud.get_air_quality(db, skip=skip, limit=limit, filters=filters)
+        response = cache.store(request, air_quality, List[schemas.GlobalResponse])
+
+    if include_total:
+        set_total_headers(response, *crud.count_air_quality(db, filters))
+    return response
+
+
+@router.post("/air-quality/bulk", tags=["Air Quality"])
+async def bulk_air_quality(
+    request: Request,
+    user=Depends(get_current_active_admin),
+    db: Session = Depends(get_db)
+):
+    #Insérer des mesures de qualité d'air en masse (JSON ou NDJSON, admin uniquement)
+    records = await read_bulk_records(request)
+    result = await run_in_threadpool(crud.bulk_insert_air_quality, db, records)
+    if result["written"]:
+        broadcaster.notify()
+    return result
+
+
+@router.get("/air-quality/stream", tags=["Air Quality"])
+async def stream_air_quality(
+    request: Request,
+    city: Optional[str] = Query(None, description="Filtrer par ville"),
+    country: Optional[str] = Query(None, description="Filtrer par pays")
+):
+    #Flux Server-Sent Events des nouvelles mesures (et émissions du pays si pas de filtre ville)
+    subscriber = broadcaster.subscribe(city, country)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if subscriber.dropped:
+                    yield f"event: lagged\ndata: {json.dumps({'dropped': subscriber.dropped})}\n\n"
+                    subscriber.dropped = 0
+                yield f"event: {event['type']}\nid: {event['id']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.websocket("/air-quality/ws")
+async def websocket_air_quality(
+    websocket: WebSocket,
+    city: Optional[str] = None,
+    country: Optional[str] = None
+):
+    #Équivalent WebSocket du flux SSE : un message JSON par nouvelle ligne
+    await websocket.accept()
+    subscriber = broadcaster.subscribe(city, country)
+    # Détecter la déconnexion même quand aucun événement n'arrive
+    receiver = asyncio.create_task(websocket.receive_text())
+    try:
+        while True:
+            getter = asyncio.create_task(subscriber.queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                getter.cancel()
+                break
+            event = getter.result()
+            if subscriber.dropped:
+                await websocket.send_json({"type": "lagged", "dropped": subscriber.dropped})
+                subscriber.dropped = 0
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        broadcaster.unsubscribe(subscriber)
 
 
 @router.get("/air-quality/{air_quality_id}", response_model=schemas.GlobalResponse, tags=["Air Quality"])
@@ -125,12 +334,18 @@ def get_air_quality_item(air_quality_id: int, db: Session = Depends(get_db)):
 # SOURCES
 @router.get("/sources", response_model=List[schemas.SourceResponse], tags=["Sources"])
 def get_sources(
+    request: Request,
     skip: int = Query(0, ge=0, description="Nombre d'éléments à sauter"),
     limit: int = Query(100, ge=1, le=1000, description="Nombre maximum d'éléments à retourner"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_guarded_db)
 ):
     #Récupérer la liste des sources de données
-    return crud.get_sources(db, skip=skip, limit=limit)
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    sources = crud.get_sources(db, skip=skip, limit=limit)
+    return cache.store(request, sources, List[schemas.SourceResponse])
 
 
 @router.get("/sources/{source_id}", response_model=schemas.SourceResponse, tags=["Sources"])
@@ -142,6 +357,17 @@ def get_source(source_id: int, db: Session = Depends(get_db)):
     return source
 
 
+# SYNCHRONISATION
+@router.get("/changes", tags=["Sync"])
+def get_changes(
+    since: int = Query(0, ge=0, description="Dernière séquence déjà appliquée (0 pour tout reprendre)"),
+    limit: int = Query(1000, ge=1, le=10000, description="Nombre maximum de modifications lues"),
+    db: Session = Depends(get_db)
+):
+    #Modifications des émissions, mesures et sources depuis une séquence (reprise après échec avec next)
+    return crud.get_changes(db, since, limit)
+
+
 # USERS
 @router.post("/users/register", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED, tags=["Users"])
 def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
@@ -226,21 +452,162 @@ def update_user(
 # STATISTIQUES
 @router.get("/stats/air/averages", tags=["Statistics"])
 def get_air_averages(
+    request: Request,
     date_from: Optional[str] = Query(None, description="Date de début (YYYY-MM-DD)"),
     date_to: Optional[str] = Query(None, description="Date de fin (YYYY-MM-DD)"),
     zone: Optional[str] = Query(None, description="Pays/Zone"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_guarded_db)
 ):
     #Moyennes des polluants sur une période
-    return crud.get_air_quality_averages(db, date_from, date_to, zone)
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    return cache.store(request, crud.get_air_quality_averages(db, date_from, date_to, zone))
 
 
 @router.get("/stats/co2/trend", tags=["Statistics"])
 def get_co2_trend(
+    request: Request,
     zone: Optional[str] = Query(None, description="Pays/Zone"),
     period: str = Query("monthly", regex="^(monthly|yearly)$", description="Période (monthly/yearly)"),
     sector: Optional[str] = Query(None, description="Secteur"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_guarded_db)
 ):
     #Évolution des émissions CO2
-    return crud.get_co2_trend(db, zone, period, sector)
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    return cache.store(request, crud.get_co2_trend(db, zone, period, sector))
+
+
+@router.get("/stats/air/timeseries", tags=["Statistics"])
+def get_air_timeseries(
+    request: Request,
+    pollutant: str = Query("pm25", regex="^(pm25|pm10|no2|so2|co|o3)$", description="Polluant"),
+    city: Optional[str] = Query(None, description="Ville"),
+    zone: Optional[str] = Query(None, description="Pays/Zone"),
+    date_from: Optional[date] = Query(None, description="Date de début (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Date de fin (YYYY-MM-DD)"),
+    points: int = Query(1000, ge=10, le=5000, description="Nombre de points cible"),
+    method: str = Query("lttb", regex="^(lttb|bucket)$", description="Réduction (lttb/bucket min-max-moyenne)"),
+    db: Session = Depends(get_guarded_db)
+):
+    #Série temporelle d'un polluant prête pour un graphique
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    series = crud.get_air_timeseries(db, pollutant, city, zone, date_from, date_to, points, method)
+    return cache.store(request, series)
+
+
+def check_windows(window: List[int]):
+
+    #Fenêtres glissantes demandées (en jours), dédoublonnées et triées
+    windows = sorted(set(window))
+    if len(windows) > ROLLING_MAX_WINDOWS or any(w < 2 or w > 365 for w in windows):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Jusqu'à {ROLLING_MAX_WINDOWS} fenêtres, chacune entre 2 et 365 jours"
+        )
+    return windows
+
+
+@router.get("/stats/air/rolling", tags=["Statistics"])
+def get_air_rolling(
+    request: Request,
+    pollutant: str = Query("pm25", regex="^(pm25|pm10|no2|so2|co|o3)$", description="Polluant"),
+    city: Optional[str] = Query(None, description="Ville"),
+    zone: Optional[str] = Query(None, description="Pays/Zone"),
+    date_from: Optional[date] = Query(None, description="Date de début (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Date de fin (YYYY-MM-DD)"),
+    window: List[int] = Query([7, 30], description="Fenêtres glissantes en jours (répétable)"),
+    db: Session = Depends(get_guarded_db)
+):
+    #Moyennes et maxima glissants, variation sur un an d'un polluant
+    windows = check_windows(window)
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    series = crud.get_air_rolling(db, pollutant, city, zone, date_from, date_to, windows)
+    return cache.store(request, series)
+
+
+@router.get("/stats/air/correlations", tags=["Statistics"])
+def get_air_correlations(
+    request: Request,
+    country: Optional[str] = Query(None, description="Filtrer par pays"),
+    city: Optional[str] = Query(None, description="Filtrer par ville"),
+    date_from: Optional[date] = Query(None, description="Date de début (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Date de fin (YYYY-MM-DD)"),
+    db: Session = Depends(get_guarded_db)
+):
+    #Matrices de corrélation entre polluants et météo
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    filters = {"city": city, "country": country, "date_from": date_from, "date_to": date_to}
+    matrices = crud.get_air_correlations(db, filters)
+    return cache.store(request, matrices)
+
+
+@router.get("/stats/air/leaderboard", tags=["Statistics"])
+def get_air_leaderboard(
+    request: Request,
+    date: Optional[date] = Query(None, description="Date (YYYY-MM-DD), par défaut la plus récente"),
+    country: Optional[str] = Query(None, description="Pays"),
+    n: int = Query(10, ge=1, le=100, description="Nombre de villes"),
+    order: str = Query("worst", regex="^(worst|best)$", description="Villes les plus (worst) ou moins (best) polluées"),
+    db: Session = Depends(get_guarded_db)
+):
+    #Classement des villes par indice de qualité de l'air (AQI)
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    leaderboard = crud.get_air_leaderboard(db, date, country, n, order)
+    return cache.store(request, leaderboard)
+
+
+@router.get("/stats/co2/timeseries", tags=["Statistics"])
+def get_co2_timeseries(
+    request: Request,
+    zone: Optional[str] = Query(None, description="Pays/Zone"),
+    sector: Optional[str] = Query(None, description="Secteur"),
+    date_from: Optional[date] = Query(None, description="Date de début (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Date de fin (YYYY-MM-DD)"),
+    points: int = Query(1000, ge=10, le=5000, description="Nombre de points cible"),
+    method: str = Query("lttb", regex="^(lttb|bucket)$", description="Réduction (lttb/bucket min-max-moyenne)"),
+    db: Session = Depends(get_guarded_db)
+):
+    #Série temporelle des émissions CO2 prête pour un graphique
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    series = crud.get_co2_timeseries(db, zone, sector, date_from, date_to, points, method)
+    return cache.store(request, series)
+
+
+@router.get("/stats/co2/rolling", tags=["Statistics"])
+def get_co2_rolling(
+    request: Request,
+    zone: Optional[str] = Query(None, description="Pays/Zone"),
+    sector: Optional[str] = Query(None, description="Secteur"),
+    date_from: Optional[date] = Query(None, description="Date de début (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Date de fin (YYYY-MM-DD)"),
+    window: List[int] = Query([7, 30], description="Fenêtres glissantes en jours (répétable)"),
+    db: Session = Depends(get_guarded_db)
+):
+    #Moyennes et maxima glissants, variation sur un an des émissions CO2
+    windows = check_windows(window)
+    cached = cache.lookup(request)
+    if cached:
+        return cached
+
+    series = crud.get_co2_rolling(db, zone, sector, date_from, date_to, windows)
+    return cache.store(request, series)
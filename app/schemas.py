@@ -87,6 +87,7 @@ class GlobalUpdate(BaseModel):
 
 class GlobalResponse(GlobalBase):
     id: int
+    aqi: Optional[float] = None
 
     class Config:
         from_attributes = True
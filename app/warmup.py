@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+from sqlalchemy import text
+
+from app import cache, counters, crud, database, dimensions
+from app.database import SessionLocal
+
+# Statistiques les plus demandées, pré-calculées au démarrage : (chemin, paramètres, fonction)
+HOT_STATS = [
+    ("/stats/air/averages", [], lambda db: crud.get_air_quality_averages(db)),
+    ("/stats/co2/trend", [], lambda db: crud.get_co2_trend(db)),
+    ("/stats/co2/trend", [("period", "yearly")], lambda db: crud.get_co2_trend(db, period="yearly")),
+]
+
+_ready = threading.Event()
+status = {"started_at": None, "duration": None, "error": None}
+
+
+def is_ready():
+
+    #Le worker a-t-il terminé son préchauffage ?
+    return _ready.is_set()
+
+
+def warm_page_cache(chunk_size: int = 1024 * 1024):
+
+    #Lire le fichier SQLite séquentiellement pour charger ses pages dans le cache de l'OS
+    path = database.engine.url.database
+    if not path or not os.path.exists(path):
+        return 0
+    read = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            read += len(chunk)
+    return read
+
+
+def warm_stats():
+
+    #Pré-calculer les statistiques chaudes dans le cache partagé (si absentes)
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+        # Dictionnaires pays / villes / secteurs (noms <-> identifiants)
+        dimensions.load()
+        # Compteurs des totaux de pagination (première exécution sur une base existante)
+        counters.ensure_counts(db)
+        for path, params, compute in HOT_STATS:
+            key = cache.make_key(path, params)
+            version = cache.get_data_version()
+            if cache.get(key, version) is None:
+                cache.put(key, cache.serialize(compute(db)), version)
+    finally:
+        db.close()
+
+
+def run():
+
+    #Préchauffage complet, puis passage à l'état "prêt"
+    status["started_at"] = time.time()
+    start = time.perf_counter()
+    try:
+        warm_page_cache()
+        warm_stats()
+    except Exception as e:
+        # Le préchauffage est une optimisation : le worker reste utilisable
+        status["error"] = str(e)
+    finally:
+        status["duration"] = round(time.perf_counter() - start, 3)
+        _ready.set()
+
+
+def start_background():
+
+    #Lancer le préchauffage sans bloquer le démarrage du serveur
+    _ready.clear()
+    thread = threading.Thread(target=run, name="ecotrack-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,223 @@
+import os
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+import urllib.error
+import urllib.request
+
+
+def free_port():
+
+    #Port TCP libre pour lancer un serveur de test
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float = 60):
+
+    #Attendre qu'une URL réponde 200, renvoie l'instant de la réponse
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(f"{url} ne répond pas après {timeout}s")
+
+
+def bench_cold_start(runs: int = 3):
+
+    #Temps d'import de l'application et temps de démarrage jusqu'à /health/live et /health/ready
+    import_times, live_times, ready_times = [], [], []
+
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c",
+             "import sys, time; t = time.perf_counter(); import app.main; "
+             "print(time.perf_counter() - t, 'numpy' in sys.modules, 'pandas' in sys.modules)"],
+            capture_output=True, text=True, check=True
+        )
+        elapsed, numpy_loaded, pandas_loaded = out.stdout.split()[-3:]
+        import_times.append(float(elapsed))
+
+        port = free_port()
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"]
+        )
+        try:
+            live_times.append(wait_for(f"http://127.0.0.1:{port}/health/live") - start)
+            ready_times.append(wait_for(f"http://127.0.0.1:{port}/health/ready") - start)
+        finally:
+            server.terminate()
+            server.wait()
+
+    return {
+        "import_app_s": round(statistics.median(import_times), 3),
+        "process_to_live_s": round(statistics.median(live_times), 3),
+        "process_to_ready_s": round(statistics.median(ready_times), 3),
+        "numpy_loaded_at_import": numpy_loaded == "True",
+        "pandas_loaded_at_import": pandas_loaded == "True",
+    }
+
+
+# Jeu synthétique au format des émissions Carbon Monitor
+BENCH_COUNTRIES = [
+    "Brazil", "China", "EU27 & UK", "France", "Germany", "India", "Italy", "Japan",
+    "ROW", "Russia", "Spain", "United Kingdom", "United States", "WORLD",
+]
+BENCH_SECTORS = ["Domestic Aviation", "Ground Transport", "Industry", "International Aviation", "Power", "Residential"]
+
+
+def _timed(conn, sql: str, params=(), runs: int = 5):
+
+    #Durée médiane d'une requête (résultat entièrement lu)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_dictionary_encoding(days: int = 2000):
+
+    #Taille de la base et temps des GROUP BY / filtres : noms en texte vs identifiants entiers
+    rows = [
+        (country, (date(2019, 1, 1) + timedelta(days=d)).isoformat(), sector, (i * 7919 % 1000) / 100)
+        for i, (d, country, sector) in enumerate(
+            (d, c, s) for d in range(days) for c in BENCH_COUNTRIES for s in BENCH_SECTORS
+        )
+    ]
+    country_ids = {name: i + 1 for i, name in enumerate(BENCH_COUNTRIES)}
+    sector_ids = {name: i + 1 for i, name in enumerate(BENCH_SECTORS)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        text_path, encoded_path = os.path.join(tmp, "text.db"), os.path.join(tmp, "encoded.db")
+
+        text_db = sqlite3.connect(text_path)
+        text_db.executescript(
+            "CREATE TABLE emissions (id INTEGER PRIMARY KEY, country TEXT, date DATE, sector TEXT, value FLOAT);"
+            "CREATE INDEX ix_country ON emissions (country);"
+            "CREATE UNIQUE INDEX ux_key ON emissions (country, date, sector);"
+        )
+        text_db.executemany("INSERT INTO emissions (country, date, sector, value) VALUES (?, ?, ?, ?)", rows)
+        text_db.commit()
+        text_db.execute("VACUUM")
+
+        encoded_db = sqlite3.connect(encoded_path)
+        encoded_db.executescript(
+            "CREATE TABLE countries (id INTEGER PRIMARY KEY, name TEXT UNIQUE);"
+            "CREATE TABLE sectors (id INTEGER PRIMARY KEY, name TEXT UNIQUE);"
+            "CREATE TABLE emissions (id INTEGER PRIMARY KEY, country_id INTEGER, date DATE, sector_id INTEGER, value FLOAT);"
+            "CREATE INDEX ix_country ON emissions (country_id);"
+            "CREATE UNIQUE INDEX ux_key ON emissions (country_id, date, sector_id);"
+        )
+        encoded_db.executemany("INSERT INTO countries (id, name) VALUES (?, ?)", [(i, n) for n, i in country_ids.items()])
+        encoded_db.executemany("INSERT INTO sectors (id, name) VALUES (?, ?)", [(i, n) for n, i in sector_ids.items()])
+        encoded_db.executemany(
+            "INSERT INTO emissions (country_id, date, sector_id, value) VALUES (?, ?, ?, ?)",
+            [(country_ids[c], d, sector_ids[s], v) for c, d, s, v in rows]
+        )
+        encoded_db.commit()
+        encoded_db.execute("VACUUM")
+
+        text_size, encoded_size = os.path.getsize(text_path), os.path.getsize(encoded_path)
+
+        group_text = _timed(text_db, "SELECT country, sector, SUM(value) FROM emissions GROUP BY country, sector")
+        group_encoded = _timed(encoded_db, "SELECT country_id, sector_id, SUM(value) FROM emissions GROUP BY country_id, sector_id")
+        filter_text = _timed(
+            text_db, "SELECT COUNT(*), SUM(value) FROM emissions WHERE country = ? AND sector = ?",
+            ("United Kingdom", "Ground Transport")
+        )
+        filter_encoded = _timed(
+            encoded_db, "SELECT COUNT(*), SUM(value) FROM emissions WHERE country_id = ? AND sector_id = ?",
+            (country_ids["United Kingdom"], sector_ids["Ground Transport"])
+        )
+        text_db.close()
+        encoded_db.close()
+
+    return {
+        "rows": len(rows),
+        "text_db_mb": round(text_size / 1e6, 2),
+        "encoded_db_mb": round(encoded_size / 1e6, 2),
+        "size_reduction_pct": round(100 * (1 - encoded_size / text_size), 1),
+        "group_by_text_ms": round(group_text * 1000, 2),
+        "group_by_encoded_ms": round(group_encoded * 1000, 2),
+        "group_by_speedup": round(group_text / group_encoded, 2),
+        "filter_text_ms": round(filter_text * 1000, 2),
+        "filter_encoded_ms": round(filter_encoded * 1000, 2),
+        "filter_speedup": round(filter_text / filter_encoded, 2),
+    }
+
+
+def bench_readonly_rows(pages: int = 5, page_size: int = 1000, runs: int = 3):
+
+    #Pages de mesures (ecotrack.db) : instances ORM contre tuples de la session en lecture seule
+    from app import crud, readonly
+    from app.database import SessionLocal
+
+    def measure(read_only: bool):
+        db = SessionLocal()
+        if read_only:
+            readonly.mark(db)
+        try:
+            crud.get_air_quality(db, 0, page_size)
+            # Mémoire retenue par une page tant qu'elle est référencée (carte d'identité comprise)
+            tracemalloc.start()
+            sizes = []
+            for p in range(pages):
+                db.expunge_all()
+                before = tracemalloc.get_traced_memory()[0]
+                page = crud.get_air_quality(db, skip=p * page_size, limit=page_size)
+                sizes.append(tracemalloc.get_traced_memory()[0] - before)
+                del page
+            tracemalloc.stop()
+
+            rates = []
+            for _ in range(runs):
+                db.expunge_all()
+                start = time.perf_counter()
+                rows = sum(len(crud.get_air_quality(db, skip=p * page_size, limit=page_size)) for p in range(pages))
+                rates.append(rows / (time.perf_counter() - start))
+            return statistics.median(sizes), statistics.median(rates)
+        finally:
+            db.close()
+
+    orm_bytes, orm_rate = measure(False)
+    tuple_bytes, tuple_rate = measure(True)
+    return {
+        "page_size": page_size,
+        "orm_kb_per_page": round(orm_bytes / 1024, 1),
+        "readonly_kb_per_page": round(tuple_bytes / 1024, 1),
+        "memory_reduction_pct": round(100 * (1 - tuple_bytes / orm_bytes), 1),
+        "orm_rows_per_s": round(orm_rate),
+        "readonly_rows_per_s": round(tuple_rate),
+        "speedup": round(tuple_rate / orm_rate, 2),
+    }
+
+
+BENCHMARKS = [
+    ("Démarrage à froid", bench_cold_start),
+    ("Dimensions encodées (pays, secteurs)", bench_dictionary_encoding),
+    ("Lectures en tuples (session en lecture seule)", bench_readonly_rows),
+]
+
+
+if __name__ == "__main__":
+    print("Benchmarks EcoTrack (à lancer depuis la racine du projet, après init)\n")
+    for title, bench in BENCHMARKS:
+        print(f"{title}:")
+        for name, value in bench().items():
+            print(f"   - {name}: {value}")
+        print()